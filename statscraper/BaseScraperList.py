@@ -1,4 +1,5 @@
 import six
+from weakref import ref
 from .compat import unicode
 from .exceptions import NoSuchItem
 
@@ -6,44 +7,211 @@ from .exceptions import NoSuchItem
 class BaseScraperList(list):
     """ Lists of dimensions, values, etc all inherit this class
     for some common convenience methods, such as get_by_label()
+
+    Lookups by id, value, label and identity are served from hash
+    indexes, that are built lazily on first use and kept in sync
+    with the list when it is modified. Items in an index are told
+    about the list, and drop its indexes when their id, value or
+    label changes, so a miss in an index is final.
     """
 
     _CONTAINS = object
+    _indexes = None  # {attribute: {key: item}}, first item wins
+    _frozen = False
 
     def get(self, key):
         """Provide alias for bracket notation."""
         return self[key]
 
+    def freeze(self):
+        """Make this list read only, e.g. to share it safely.
+
+        Copies of a frozen list are writable.
+        """
+        self._frozen = True
+        return self
+
     def get_by_label(self, label):
         """ Return the first item with a specific label,
         or None.
         """
-        return next((x for x in self if x.label == label), None)
+        return self._lookup("label", label)
 
     def __getitem__(self, key):
         """ Make it possible to get item by id or value identity."""
         if isinstance(key, six.string_types):
-            if isinstance(key, unicode):
-                def f(x):
-                    return (x.id == key)
-            else:
-                def f(x):
-                    return (x.id == unicode(key, encoding="utf-8"))
+            if not isinstance(key, unicode):
+                key = unicode(key, encoding="utf-8")
+            item = self._lookup("id", key)
         elif isinstance(key, self._CONTAINS):
-            def f(x):
-                return (x is key)
+            item = self._lookup_identity(key)
         else:
             return list.__getitem__(self, key)
 
-        try:
-            return next(iter(filter(f, self)))
-        except StopIteration:
+        if item is None:
             # No such item
             raise NoSuchItem("No such %s: %s" % (self._CONTAINS.__name__, key))
+        return item
 
     def __contains__(self, item):
         """ Make the 'in' keyword check for value/id """
         if isinstance(item, six.string_types):
-            return bool(len(list(filter(lambda x: x.value == item, self))))
+            return self._lookup("value", item) is not None
+        elif isinstance(item, self._CONTAINS):
+            return self._lookup_identity(item) is not None
         else:
-            return super(BaseScraperList, self).__contains__(item)
\ No newline at end of file
+            return super(BaseScraperList, self).__contains__(item)
+
+    # Indexes
+
+    def _get_index(self, attr):
+        """Return the index for an attribute, building it if needed."""
+        if self._indexes is None:
+            self._indexes = {}
+        if attr not in self._indexes:
+            index = {}
+            for x in self:
+                _add_to_index(index, attr, x)
+                _watch(x, self)
+            self._indexes[attr] = index
+        return self._indexes[attr]
+
+    def _lookup(self, attr, key):
+        """Return the first item where `attr` equals `key`, or None."""
+        try:
+            return self._get_index(attr).get(key)
+        except TypeError:
+            # Unhashable keys can only be found by scanning
+            return next((x for x in self if getattr(x, attr, None) == key),
+                        None)
+
+    def _lookup_identity(self, obj):
+        """Return `obj` if it is in this list, or None."""
+        return self._get_index(None).get(id(obj))
+
+    def _reset_indexes(self):
+        self._indexes = None
+
+    def _check_writable(self):
+        if self._frozen:
+            raise TypeError("This %s is read only" % type(self).__name__)
+
+    # Copies and unpickled lists are writable, and build their own indexes
+
+    def __copy__(self):
+        copied = type(self)(self)
+        copied.__dict__.update(self._get_state())
+        return copied
+
+    def __reduce_ex__(self, protocol):
+        return (type(self), (list(self),), self._get_state())
+
+    def _get_state(self):
+        state = dict(self.__dict__)
+        state.pop("_indexes", None)
+        state.pop("_frozen", None)
+        return state
+
+    # Keep indexes in sync with the list
+
+    def append(self, val):
+        self._check_writable()
+        super(BaseScraperList, self).append(val)
+        if self._indexes:
+            for attr, index in self._indexes.items():
+                _add_to_index(index, attr, val)
+            _watch(val, self)
+
+    def extend(self, vals):
+        self._check_writable()
+        super(BaseScraperList, self).extend(vals)
+        self._reset_indexes()
+
+    def insert(self, i, val):
+        self._check_writable()
+        super(BaseScraperList, self).insert(i, val)
+        self._reset_indexes()
+
+    def remove(self, val):
+        self._check_writable()
+        super(BaseScraperList, self).remove(val)
+        self._reset_indexes()
+
+    def pop(self, *args):
+        self._check_writable()
+        val = super(BaseScraperList, self).pop(*args)
+        self._reset_indexes()
+        return val
+
+    def sort(self, *args, **kwargs):
+        self._check_writable()
+        super(BaseScraperList, self).sort(*args, **kwargs)
+        self._reset_indexes()
+
+    def reverse(self):
+        self._check_writable()
+        super(BaseScraperList, self).reverse()
+        self._reset_indexes()
+
+    def __setitem__(self, key, val):
+        self._check_writable()
+        super(BaseScraperList, self).__setitem__(key, val)
+        self._reset_indexes()
+
+    def __delitem__(self, key):
+        self._check_writable()
+        super(BaseScraperList, self).__delitem__(key)
+        self._reset_indexes()
+
+    def __iadd__(self, vals):
+        self.extend(vals)
+        return self
+
+    def __imul__(self, n):
+        self._check_writable()
+        val = super(BaseScraperList, self).__imul__(n)
+        self._reset_indexes()
+        return val
+
+    if six.PY2:
+        # Python 2 slicing bypasses __setitem__ and __delitem__
+        def __setslice__(self, i, j, vals):
+            self._check_writable()
+            super(BaseScraperList, self).__setslice__(i, j, vals)
+            self._reset_indexes()
+
+        def __delslice__(self, i, j):
+            self._check_writable()
+            super(BaseScraperList, self).__delslice__(i, j)
+            self._reset_indexes()
+
+
+def _watch(item, lst):
+    """Let an item drop the indexes of a list, when it changes.
+
+    See BaseScraperObject._changed(). Other objects are not watched.
+    """
+    try:
+        lists = item._indexed_by
+    except AttributeError:
+        lists = {}
+        try:
+            item._indexed_by = lists
+        except AttributeError:
+            return
+    lists[id(lst)] = ref(lst)
+
+
+def _add_to_index(index, attr, item):
+    """Add an item to an index, unless an earlier item has the same key.
+
+    The `None` attribute indexes items by identity.
+    """
+    if attr is None:
+        index[id(item)] = item
+        return
+    try:
+        index.setdefault(getattr(item, attr), item)
+    except (AttributeError, TypeError):
+        # Missing or unhashable attribute: Never found by a hashable key
+        pass
@@ -7,6 +7,41 @@ class BaseScraperObject(object):
     BaseScraperList.
     """
 
+    __slots__ = ()
+
+    # Attributes that BaseScraperLists index items by
+    _INDEXED = frozenset(["id", "label", "_value"])
+    # Attributes that are left out of copies and pickles
+    _UNPICKLED = frozenset(["_indexed_by"])
+
+    def _changed(self):
+        """Drop the indexes of any list with this object.
+
+        Called when the id, value or label changes.
+        """
+        lists = getattr(self, "_indexed_by", None)
+        if lists:
+            for ref in list(lists.values()):
+                lst = ref()
+                if lst is not None:
+                    lst._reset_indexes()
+            lists.clear()
+
+    def __getstate__(self):
+        """Return the attributes to pickle, including any in __slots__."""
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        for name in self._UNPICKLED:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
     def get(self, key):
         """Provide alias for bracket notation."""
         return self[key]
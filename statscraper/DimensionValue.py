@@ -4,9 +4,12 @@ from .BaseScraperObject import BaseScraperObject
 class DimensionValue(BaseScraperObject):
     """The value for a dimension inside a Resultset."""
 
+    __slots__ = ("_value", "_dimension", "_label", "_id", "dialects",
+                 "_indexed_by")
+
     def __init__(self, value, dimension, label=None):
         """Value can be any type. dimension is a Dimension() object."""
-        self.value = value
+        self._value = value
         self._dimension = dimension
         self._label = label
         self._id = dimension.id
@@ -18,6 +21,16 @@ class DimensionValue(BaseScraperObject):
     @id.setter
     def id(self, value):
         self._id = value
+        self._changed()
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._changed()
 
     @property
     def label(self):
@@ -26,6 +39,7 @@ class DimensionValue(BaseScraperObject):
     @label.setter
     def label(self, value):
         self._label = value
+        self._changed()
 
     @property
     def dimension(self):
@@ -41,5 +55,7 @@ class DimensionValue(BaseScraperObject):
             dt = self.dimension.datatype
             if self.value in dt.allowed_values:
                 translations = dt.allowed_values[self.value]
-                translation = (",").join([x.replace(",", "\,") for x in translations.dialects[dialect]])
+                # Values without this dialect are left as they are
+                if translations.dialects.get(dialect):
+                    translation = (",").join([x.replace(",", "\,") for x in translations.dialects[dialect]])
         return translation
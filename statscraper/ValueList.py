@@ -2,6 +2,7 @@ import six
 from .compat import unicode
 from .BaseScraperList import BaseScraperList
 from .DimensionValue import DimensionValue
+from .exceptions import NoSuchItem
 
 
 class ValueList(BaseScraperList):
@@ -13,27 +14,21 @@ class ValueList(BaseScraperList):
     def __getitem__(self, key):
         """Make it possible to get value by value or value identity."""
         if isinstance(key, six.string_types):
-            if isinstance(key, unicode):
-                def f(x):
-                    return (x.value == key)
-            else:
-                def f(x):
-                    return (x.value == unicode(key, encoding="utf-8"))
+            if not isinstance(key, unicode):
+                key = unicode(key, encoding="utf-8")
+            val = self._lookup("value", key)
         elif isinstance(key, DimensionValue):
-            def f(x):
-                return (x is key)
+            val = self._lookup_identity(key)
         else:
             return list.__getitem__(self, key)
-        try:
-            val = next(iter(filter(f, self)))
-            return val
-        except IndexError:
-            # No such id
+        if val is None:
+            # No such value
             raise NoSuchItem("No such value")
+        return val
 
     def __contains__(self, item):
         """ in should look for value, not id. """
         if isinstance(item, six.string_types):
-            return bool(len(list(filter(lambda x: x.value == item, self))))
+            return self._lookup("value", item) is not None
         else:
             return super(ValueList, self).__contains__(item)
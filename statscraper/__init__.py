@@ -8,7 +8,8 @@ from .BaseScraperObject import BaseScraperObject
 from .ValueList import ValueList
 from .datatypes import Datatype
 from .base_scraper import (BaseScraper, Item, Collection, Dataset, Result,
-						   ResultSet, ItemList, Dimension, DimensionList)
+						   ResultSet, ColumnarResultSet, DiskResultSet, ItemList,
+						   Dimension, DimensionList, canonical_query)
 
 # Contants
-from .base_scraper import ROOT, TYPE_DATASET, TYPE_COLLECTION
+from .base_scraper import ROOT, TYPE_DATASET, TYPE_COLLECTION, VALUE_KEY
@@ -16,7 +16,8 @@ u"""
  A scraper can override three methods:
   * _fetch_itemslist(item) yields items at the current position
   * _fetch_dimensions(dataset) yields dimensions available on a dataset
-  * _fetch_data(dataset) syield rows from a dataset
+  * _fetch_data(dataset) syield rows from a dataset, as Result objects
+    or in batches (see ResultSet.append_batch)
 
  A number of hooks are avaiable for more advanced scrapers. These are called
  by adding the on decorator on a method:
@@ -27,21 +28,29 @@ u"""
 
 """
 import six
+import sys
+from array import array
 from hashlib import md5
 from json import dumps
+import numpy as np
 import pandas as pd
-from collections import deque
+from pandas.api import types as ptypes
+from collections import deque, OrderedDict
 from copy import copy
+from multiprocessing.pool import ThreadPool
+from tempfile import TemporaryFile
+from threading import RLock
+from six.moves import cPickle as pickle
 from .exceptions import NoSuchItem, InvalidID
+from .compat import unicode
+from .cache import ResultCache, DocumentCache
+from .session import create_session, DEFAULT_TIMEOUT
 from .datatypes import Datatype
 from .BaseScraperObject import BaseScraperObject
 from .BaseScraperList import BaseScraperList
 from .DimensionValue import DimensionValue
 from .ValueList import ValueList
 
-if six.PY3:
-    unicode = str
-
 try:
     from itertools import ifilter as filter
 except ImportError:
@@ -54,6 +63,49 @@ VALUE_KEY = "value"  # key/column holding the value of a result or dimension
 """ Constants for item types and id's """
 
 
+def canonical_query(query):
+    """Return a normalized copy of a query, for comparing queries.
+
+    Queries that only differ in the order of values, in single values
+    being given as lists or not, or in values being given as objects
+    (e.g. DimensionValues) or their values, are made equal:
+
+      >>> canonical_query({"region": ["03", DimensionValue("01", region)]})
+      {u'region': [u'01', u'03']}
+      >>> canonical_query({"region": "01"}) == canonical_query({"region": ["01"]})
+      True
+    """
+    if isinstance(query, dict):
+        return {_canonical_value(k): _canonical_values(v)
+                for k, v in query.items()}
+    return _canonical_values(query)
+
+
+def _canonical_values(values):
+    """Return a sorted list of distinct values, or a canonical dict."""
+    if values is None:
+        return None
+    if isinstance(values, dict):
+        return canonical_query(values)
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        values = [values]
+    canonical = {}
+    for value in values:
+        value = _canonical_value(value)
+        canonical[dumps(value, sort_keys=True, default=repr)] = value
+    return [canonical[k] for k in sorted(canonical)]
+
+
+def _canonical_value(value):
+    if isinstance(value, BaseScraperObject):
+        value = value.value
+    if isinstance(value, six.binary_type):
+        value = value.decode("utf-8")
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        return _canonical_values(value)
+    return value
+
+
 class ResultSet(list):
     """The result of a dataset query.
 
@@ -61,6 +113,8 @@ class ResultSet(list):
     """
 
     _pandas = None
+    _dimension_cache = None
+    _schemas = None  # {tuple of keys: tuple of dimensions}
     dataset = None
 
     @property
@@ -75,16 +129,87 @@ class ResultSet(list):
             self._pandas = pd.DataFrame().from_records(self.list_of_dicts)
         return self._pandas
 
+    @property
+    def dimensionvalues(self):
+        """Dimension values of the last result."""
+        if len(self):
+            return self[-1].dimensionvalues
+
+    @property
+    def nbytes(self):
+        """Approximate memory use, not counting shared dimension values."""
+        nbytes = sys.getsizeof(self)
+        for result in list.__iter__(self):
+            nbytes += sys.getsizeof(result) + sys.getsizeof(result.value)
+            if result._values is not None:
+                nbytes += sys.getsizeof(result._values)
+            if result._raw_dimensions is not None:
+                nbytes += sys.getsizeof(result._raw_dimensions)
+        return nbytes
+
     def translate(self, dialect):
         """Return a copy of this ResultSet in a different dialect."""
-        new_resultset = copy(self)
+        new_resultset = type(self)()
+        new_resultset.dataset = self.dataset
         new_resultset.dialect = dialect
 
-        for result in new_resultset:
-            for dimensionvalue in result.dimensionvalues:
-                dimensionvalue.value = dimensionvalue.translate(dialect)
+        translations = {}
+        for result in self:
+            new_resultset._store(self._translate_result(result, dialect,
+                                                        translations))
         return new_resultset
 
+    def _translate_result(self, result, dialect, translations):
+        """Return a translated copy of a result.
+
+        `translations` caches translated values between calls.
+        """
+        values = []
+        for dimensionvalue in result._iter_dimensionvalues():
+            key = (id(dimensionvalue.dimension), dimensionvalue.value)
+            if key not in translations:
+                translations[key] = dimensionvalue.translate(dialect)
+            values.append(translations[key])
+        translated = Result(result.value)
+        translated._raw_dimensions = None
+        translated._dimensions = result._dimensions
+        translated._values = tuple(values)
+        translated.dataset = result.dataset
+        return translated
+
+    def _get_dimension(self, key):
+        """Return the dimension to use for values with this key.
+
+        Looked up once per key and ResultSet. Keys that are not among
+        the dataset's dimensions share a single anonymous Dimension.
+        """
+        if self._dimension_cache is None:
+            self._dimension_cache = {}
+        try:
+            return self._dimension_cache[key]
+        except KeyError:
+            pass
+        dataset_dimensions = self.dataset.dimensions
+        if key in dataset_dimensions:
+            d = dataset_dimensions[key]
+        else:
+            d = self._dimension_cache.setdefault(None, Dimension())
+        self._dimension_cache[key] = d
+        return d
+
+    def _get_schema(self, keys):
+        """Return a tuple of dimensions for a tuple of keys.
+
+        Results with the same keys share the same tuple.
+        """
+        if self._schemas is None:
+            self._schemas = {}
+        try:
+            return self._schemas[keys]
+        except KeyError:
+            schema = tuple(self._get_dimension(k) for k in keys)
+            return self._schemas.setdefault(keys, schema)
+
     def append(self, val):
         """Connect any new results to the resultset.
 
@@ -96,48 +221,485 @@ class ResultSet(list):
         a resultset.
          - This is also where we normalize dialects.
         """
+        self._store(self._attach(val))
+
+    def extend(self, vals):
+        """Append results, or a batch of results.
+
+        `vals` is either an iterable of Result objects, or a batch, as
+        taken by append_batch().
+        """
+        if _is_batch(vals):
+            self.append_batch(vals)
+            return
+        for val in vals:
+            self.append(val)
+
+    def __iadd__(self, vals):
+        self.extend(vals)
+        return self
+
+    def _store(self, result):
+        """Store a result that is already normalized."""
+        result.resultset = self
+        super(ResultSet, self).append(result)
+
+    def _dump(self):
+        """Return the results as plain, picklable data.
+
+        Returns a list of dimension id tuples, and a list of
+        (value, index of dimension ids, dimension values) for each row.
+        """
+        schemas, schema_numbers, rows = [], {}, []
+        for result in self:
+            schema = result._dimensions
+            if id(schema) not in schema_numbers:
+                schema_numbers[id(schema)] = len(schemas)
+                schemas.append(tuple(d.id for d in schema))
+            values = tuple(v.value if isinstance(v, DimensionValue) else v
+                           for v in result._values)
+            rows.append((result.value, schema_numbers[id(schema)], values))
+        return (schemas, rows)
+
+    def _load(self, dump):
+        """Add results from _dump(), without normalizing them again."""
+        self._pandas = None
+        schemas, rows = dump
+        schemas = [self._get_schema(keys) for keys in schemas]
+        for value, schema_number, values in rows:
+            self._store(self._make_result(value, schemas[schema_number],
+                                          values))
+
+    def _make_result(self, value, dimensions, values):
+        """Create a Result from a tuple of dimensions, and their values."""
+        result = Result(value)
+        result._raw_dimensions = None
+        result._dimensions = dimensions
+        result._values = values
+        result.resultset = self
+        result.dataset = self.dataset
+        return result
+
+    def append_batch(self, columns):
+        """Add a batch of results, given column by column.
+
+        `columns` is a dict (of lists, arrays or Series) or a pandas
+        DataFrame, with the values of the results under VALUE_KEY, and
+        one column for each dimension. Dimension columns can be pandas
+        Categoricals. Missing dimension values (None, NaN, or a code of
+        -1) are left out of the results.
+
+        Dialects are normalized once per distinct value in each column,
+        rather than once per result.
+        """
+        self._pandas = None
+        values, dimensions = _decode_batch(columns)
+        if not self.dataset:
+            for i, value in enumerate(values):
+                self.append(Result(value, {
+                    key: categories[codes[i]]
+                    for key, codes, categories in dimensions
+                    if codes[i] >= 0}))
+            return
+
+        keys, rows, missing = [], [], False
+        for key, codes, categories in dimensions:
+            dimension = self._get_dimension(key)
+            normalized = [dimension.normalize(x) for x in categories]
+            keys.append(key)
+            # Code -1 picks the last item
+            rows.append(np.array(normalized + [_MISSING], dtype=object)
+                        [codes].tolist())
+            missing = missing or bool((codes < 0).any())
+        rows = list(zip(*rows)) if rows else [()] * len(values)
+        keys = tuple(keys)
+
+        schema = self._get_schema(keys)
+        for value, row in zip(values, rows):
+            if missing and _MISSING in row:
+                present = [i for i, x in enumerate(row) if x is not _MISSING]
+                self._store(self._make_result(
+                    value, self._get_schema(tuple(keys[i] for i in present)),
+                    tuple(row[i] for i in present)))
+            else:
+                self._store(self._make_result(value, schema, row))
+
+    def _attach(self, val):
+        """Connect a result to this ResultSet, without storing it.
+
+        Normalizes the dimensions of the result, see append().
+        """
         val.resultset = self
         val.dataset = self.dataset
 
         # Check result dimensions against available dimensions for this dataset
         if val.dataset:
-            dataset_dimensions = self.dataset.dimensions
-            for k, v in val.raw_dimensions.items():
-                if k not in dataset_dimensions:
-                    d = Dimension(k)
-                else:
-                    d = dataset_dimensions[k]
-
+            items = list(val.raw_dimensions.items())
+            dimensions = self._get_schema(tuple(k for k, v in items))
+            values = []
+            for d, (k, v) in zip(dimensions, items):
                 # Normalize if we have a datatype and a foreign dialect
-                normalized_value = unicode(v)
-                if d.dialect and d.datatype:
-                    if d.dialect in d.datatype.dialects:
-                        for av in d.allowed_values:
-                            # Not all allowed_value have all dialects
-                            if unicode(v) in av.dialects.get(d.dialect, []):
-                                normalized_value = av.value
-                                # Use first match
-                                # We do not support multiple matches
-                                # This is by design.
-                                break
-
-                # Create DimensionValue object
+                normalized_value = d.normalize(v)
+
+                # Keep DimensionValue objects, but store plain values
                 if isinstance(v, DimensionValue):
-                    dim = v
                     v.value = normalized_value
+                    values.append(v)
                 else:
-                    if k in dataset_dimensions:
-                        dim = DimensionValue(normalized_value, d)
-                    else:
-                        dim = DimensionValue(normalized_value, Dimension())
+                    values.append(normalized_value)
+
+            val._dimensions = dimensions
+            val._values = tuple(values)
+            # The raw dimensions are not needed anymore
+            val._raw_dimensions = None
+        return val
+
+
+_MISSING = object()  # Marks missing dimension values in a batch
 
-                val.dimensionvalues.append(dim)
 
-            # Add last list of dimension values to the ResultSet
-            # They will usually be the same for each result
-            self.dimensionvalues = val.dimensionvalues
+def _is_batch(obj):
+    """Check if an object is a batch of results, rather than a Result."""
+    if isinstance(obj, np.ndarray):
+        # A structured (record) array, with a field for each column
+        return obj.dtype.names is not None
+    return isinstance(obj, (dict, pd.DataFrame))
 
-        super(ResultSet, self).append(val)
+
+def _decode_batch(columns):
+    """Return the values of a batch, and its dimensions as codes.
+
+    Dimensions are returned as a list of (key, array of codes, list of
+    distinct values), with -1 for missing values.
+    """
+    if isinstance(columns, np.ndarray):
+        columns = OrderedDict((name, columns[name])
+                              for name in columns.dtype.names)
+    values = None
+    dimensions = []
+    for key, column in columns.items():
+        if key == VALUE_KEY:
+            values = column.tolist() if hasattr(column, "tolist") \
+                else list(column)
+            continue
+        if not isinstance(column, pd.Categorical):
+            if ptypes.is_categorical_dtype(column):
+                column = pd.Categorical(column)
+            else:
+                column = pd.Categorical.from_codes(
+                    *pd.factorize(np.asarray(column, dtype=object)))
+        dimensions.append((key,
+                           np.asarray(column.codes, dtype=np.intp),
+                           list(column.categories)))
+    if values is None:
+        raise ValueError("A batch must have a %s column" % VALUE_KEY)
+    return (values, dimensions)
+
+
+class ColumnarResultSet(ResultSet):
+    """A ResultSet that stores its data column by column.
+
+    Values are kept in one list, and each dimension is dictionary
+    encoded, as an array of integer codes into a list of its distinct,
+    normalized values. Dialects are normalized once per distinct value.
+
+    Result objects are created when rows are accessed, and are not kept,
+    so `rs[0] is rs[0]` is not true. DimensionValue objects yielded by
+    a scraper are stored as their values.
+
+    Use it for a scraper by setting `resultset_class`:
+
+      >>> scraper = SCB()
+      >>> scraper.resultset_class = ColumnarResultSet
+    """
+
+    CODE_TYPE = 'i'  # array typecode for codes, -1 for missing values
+
+    def __init__(self, results=()):
+        super(ColumnarResultSet, self).__init__()
+        self._values = []
+        self._keys = []  # Dimension keys, in order of appearance
+        self._codes = {}  # {key: array of codes}
+        self._categories = {}  # {key: [normalized values]}
+        self._category_codes = {}  # {key: {normalized value: code}}
+        self._encodings = {}  # {key: {raw value: code}}
+        for result in results:
+            self.append(result)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get_result(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get_result(i)
+                    for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("ResultSet index out of range")
+        return self._get_result(key)
+
+    if six.PY2:
+        # Python 2 slicing bypasses __getitem__
+        def __getslice__(self, i, j):
+            return self[slice(i, j)]
+
+    def __repr__(self):
+        return '<%s: %s rows>' % (type(self).__name__, len(self))
+
+    def __reduce_ex__(self, protocol):
+        # The list itself is empty, so only the columns are pickled
+        return (type(self), (), self.__dict__.copy())
+
+    @property
+    def nbytes(self):
+        """Approximate memory use, not counting shared dimension values."""
+        nbytes = sys.getsizeof(self._values)
+        nbytes += sum(sys.getsizeof(v) for v in self._values)
+        for codes in self._codes.values():
+            nbytes += codes.buffer_info()[1] * codes.itemsize
+        return nbytes
+
+    def _get_result(self, i):
+        """Create a Result object for a row."""
+        result = Result(self._values[i])
+        result.resultset = self
+        result.dataset = self.dataset
+        keys, values = [], []
+        for key in self._keys:
+            code = self._codes[key][i]
+            if code >= 0:
+                keys.append(key)
+                values.append(self._categories[key][code])
+        result._raw_dimensions = None
+        result._dimensions = self._get_schema(tuple(keys))
+        result._values = tuple(values)
+        return result
+
+    def _encode(self, key, value):
+        """Return the code for a raw value, adding it if needed."""
+        encoding = self._encodings[key]
+        try:
+            return encoding[value]
+        except KeyError:
+            hashable = True
+        except TypeError:
+            hashable = False
+
+        normalized_value = self._get_dimension(key).normalize(value)
+        # Different raw values can share a normalized value
+        code = self._encode_normalized(key, normalized_value)
+        if hashable:
+            encoding[value] = code
+        return code
+
+    def _encode_normalized(self, key, value):
+        """Return the code for a normalized value, adding it if needed."""
+        category_codes = self._category_codes[key]
+        code = category_codes.get(value)
+        if code is None:
+            categories = self._categories[key]
+            code = len(categories)
+            categories.append(value)
+            category_codes[value] = code
+        return code
+
+    def _add_key(self, key):
+        self._keys.append(key)
+        self._codes[key] = array(self.CODE_TYPE, [-1]) * len(self)
+        self._categories[key] = []
+        self._category_codes[key] = {}
+        self._encodings[key] = {}
+
+    def append(self, val):
+        """Add a result, storing its value and dimension codes.
+
+        The result itself is normalized from the stored row, as by
+        ResultSet.append(), since fetch_next() yields it.
+        """
+        self._pandas = None
+        if self.dataset:
+            for k, v in val.raw_dimensions.items():
+                if k not in self._codes:
+                    self._add_key(k)
+                self._codes[k].append(self._encode(k, v))
+        self._values.append(val.value)
+        self._pad()
+
+        row = self._get_result(len(self) - 1)
+        val.resultset = self
+        val.dataset = self.dataset
+        if self.dataset:
+            val._dimensions = row._dimensions
+            val._values = row._values
+            val._raw_dimensions = None
+
+    def _store(self, result):
+        self._pandas = None
+        for d, v in zip(result._dimensions, result._values):
+            if isinstance(v, DimensionValue):
+                v = v.value
+            if d.id not in self._codes:
+                self._add_key(d.id)
+            self._codes[d.id].append(self._encode_normalized(d.id, v))
+        self._values.append(result.value)
+        self._pad()
+
+    def _pad(self):
+        """Pad columns that the last results did not have."""
+        for codes in self._codes.values():
+            if len(codes) < len(self._values):
+                codes.extend([-1] * (len(self._values) - len(codes)))
+
+    def append_batch(self, columns):
+        """Add a batch of results, given column by column.
+
+        Codes are translated to the codes of this ResultSet in one go.
+        See ResultSet.append_batch() for the format of `columns`.
+        """
+        if not self.dataset:
+            return super(ColumnarResultSet, self).append_batch(columns)
+        self._pandas = None
+        values, dimensions = _decode_batch(columns)
+        length = len(self)
+        for key, codes, categories in dimensions:
+            if key not in self._codes:
+                self._add_key(key)
+            column = self._codes[key]
+            if len(column) < length:
+                column.extend([-1] * (length - len(column)))
+            recode = [self._encode(key, x) for x in categories] + [-1]
+            # Code -1 picks the last item
+            new_codes = np.array(recode, dtype=column.typecode)[codes]
+            column.extend(array(self.CODE_TYPE, new_codes.tobytes()))
+        self._values.extend(values)
+        self._pad()
+
+    @property
+    def pandas(self):
+        """Return a Pandas dataframe, with dimensions as categoricals."""
+        if self._pandas is None:
+            columns = [(VALUE_KEY, self._values)]
+            for key in self._keys:
+                codes = np.frombuffer(self._codes[key],
+                                      dtype=self._codes[key].typecode)
+                categorical = pd.Categorical.from_codes(
+                    codes, categories=self._categories[key])
+                columns.append((self._get_dimension(key).id, categorical))
+            self._pandas = pd.DataFrame.from_dict(OrderedDict(columns))
+        return self._pandas
+
+    def translate(self, dialect):
+        """Return a copy of this ResultSet in a different dialect.
+
+        Only the distinct values of each dimension are translated.
+        """
+        new_resultset = type(self)()
+        new_resultset.dataset = self.dataset
+        new_resultset.dialect = dialect
+        new_resultset._values = list(self._values)
+        for key in self._keys:
+            dimension = self._get_dimension(key)
+            translations = [DimensionValue(x, dimension).translate(dialect)
+                            for x in self._categories[key]]
+            # Translations need not be distinct, so recode
+            categories, recode = [], []
+            category_codes = {}
+            for translation in translations:
+                if translation not in category_codes:
+                    category_codes[translation] = len(categories)
+                    categories.append(translation)
+                recode.append(category_codes[translation])
+            recode.append(-1)  # Missing values stay missing
+            codes = np.frombuffer(self._codes[key],
+                                  dtype=self._codes[key].typecode)
+            new_codes = np.array(recode, dtype=codes.dtype)[codes]
+
+            new_resultset._keys.append(key)
+            new_resultset._codes[key] = array(self.CODE_TYPE,
+                                              new_codes.tobytes())
+            new_resultset._categories[key] = categories
+            new_resultset._category_codes[key] = category_codes
+            new_resultset._encodings[key] = {}
+        return new_resultset
+
+
+class DiskResultSet(ResultSet):
+    """A ResultSet that keeps its rows in a temporary file.
+
+    Only the file offset of each row is kept in memory. Result objects
+    are read back from disk as rows are accessed, and are not kept.
+    DimensionValue objects yielded by a scraper are stored as their
+    values. The file is removed when the ResultSet is garbage collected.
+    """
+
+    def __init__(self, results=()):
+        super(DiskResultSet, self).__init__()
+        self._file = TemporaryFile()
+        self._lock = RLock()
+        self._offsets = array('L')
+        self._schema_numbers = {}  # {id(schema): number}
+        self._schema_list = []
+        for result in results:
+            self.append(result)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._read(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._read(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("ResultSet index out of range")
+        return self._read(key)
+
+    if six.PY2:
+        # Python 2 slicing bypasses __getitem__
+        def __getslice__(self, i, j):
+            return self[slice(i, j)]
+
+    def __repr__(self):
+        return '<%s: %s rows>' % (type(self).__name__, len(self))
+
+    @property
+    def nbytes(self):
+        """Memory use. Only the offsets of the rows are kept in memory."""
+        return self._offsets.buffer_info()[1] * self._offsets.itemsize
+
+    def append(self, val):
+        """Normalize a result, and write it to disk."""
+        self._pandas = None
+        self._store(self._attach(val))
+
+    def _store(self, result):
+        schema = result._dimensions
+        if id(schema) not in self._schema_numbers:
+            self._schema_numbers[id(schema)] = len(self._schema_list)
+            self._schema_list.append(schema)
+        values = tuple(v.value if isinstance(v, DimensionValue) else v
+                       for v in result._values)
+        row = (result.value, self._schema_numbers[id(schema)], values)
+        with self._lock:
+            self._file.seek(0, 2)
+            self._offsets.append(self._file.tell())
+            pickle.dump(row, self._file, pickle.HIGHEST_PROTOCOL)
+
+    def _read(self, i):
+        with self._lock:
+            self._file.seek(self._offsets[i])
+            value, schema_number, values = pickle.load(self._file)
+        return self._make_result(value, self._schema_list[schema_number],
+                                 values)
 
 
 class DimensionList(BaseScraperList):
@@ -151,28 +713,77 @@ class Result(BaseScraperObject):
 
     A result contains a numerical value,
     and optionally a set of dimensions with values.
+
+    Once added to a ResultSet, the dimension values of a result are
+    kept in a tuple, next to a tuple of their dimensions that is shared
+    with other results in the ResultSet. DimensionValue objects are
+    created as they are accessed.
     """
 
+    __slots__ = ("_value", "_raw_dimensions", "_dimensions", "_values",
+                 "resultset", "dataset")
+    label = VALUE_KEY
+
     def __init__(self, value, dimensions={}):
         """Value is supposed, but not strictly required to be numerical."""
         self.value = value
-        self.label = VALUE_KEY
-        self.raw_dimensions = dimensions
-        self.dimensionvalues = DimensionList()
+        self._raw_dimensions = dimensions
+        self._dimensions = ()
+        self._values = ()
+        self.resultset = None
+        self.dataset = None
+
+    @property
+    def raw_dimensions(self):
+        """Dimensions as given by the scraper.
+
+        After the result is added to a ResultSet, this is rebuilt from
+        the normalized values.
+        """
+        if self._raw_dimensions is None:
+            return {d.id: v for d, v in zip(self._dimensions, self._values)}
+        return self._raw_dimensions
+
+    @raw_dimensions.setter
+    def raw_dimensions(self, value):
+        self._raw_dimensions = value
+
+    @property
+    def dimensionvalues(self):
+        """DimensionList with the dimension values of this result."""
+        return DimensionList(self._iter_dimensionvalues())
+
+    @dimensionvalues.setter
+    def dimensionvalues(self, value):
+        value = list(value)
+        self._dimensions = tuple(dv.dimension for dv in value)
+        self._values = tuple(value)
+
+    def _iter_dimensionvalues(self):
+        for d, v in zip(self._dimensions, self._values):
+            if isinstance(v, DimensionValue):
+                yield v
+            else:
+                yield DimensionValue(v, d)
 
     def __getitem__(self, key):
         """ Make it possible to get dimensions by name. """
         if isinstance(key, six.string_types):
-            return self.dimensionvalues[key]
+            if not isinstance(key, unicode):
+                key = unicode(key, encoding="utf-8")
+            for dv in self._iter_dimensionvalues():
+                if dv.id == key:
+                    return dv
+            raise NoSuchItem("No such Dimension: %s" % key)
         else:
-            return list.__getitem__(self, key)
+            return self.dimensionvalues[key]
 
     def __iter__(self):
         """ dict representation is like:
          {value: 123, dimension_1: "foo", dimension_2: "bar"}
         """
         yield (VALUE_KEY, self.value)
-        for dv in self.dimensionvalues:
+        for dv in self._iter_dimensionvalues():
             yield (dv.id,
                    dv.value)
 
@@ -193,7 +804,8 @@ class Result(BaseScraperObject):
         """ Tuple conversion to (value, dimensions), e.g.:
          (123, {dimension_1: "foo", dimension_2: "bar"})
         """
-        return (self.value, {dv.id: dv.value for dv in self.dimensionvalues})
+        return (self.value, {dv.id: dv.value
+                             for dv in self._iter_dimensionvalues()})
 
 
 class Dimension(BaseScraperObject):
@@ -213,6 +825,7 @@ class Dimension(BaseScraperObject):
             raise InvalidID("'%s' is not a valid Dimension id." % VALUE_KEY)
         self.id = id_
         self._allowed_values = None
+        self._dialect_maps = {}
         self.datatype = None
         if label is None:
             self.label = id_
@@ -220,7 +833,6 @@ class Dimension(BaseScraperObject):
             self.label = label
         if datatype:
             self.datatype = Datatype(datatype)
-            self._allowed_values = self.datatype.allowed_values
         self.dialect = dialect
         if allowed_values:
             # Override allowed values from datatype, if any
@@ -236,19 +848,59 @@ class Dimension(BaseScraperObject):
                                                                Dimension())
                                                 )
 
+    def __setattr__(self, name, value):
+        super(Dimension, self).__setattr__(name, value)
+        if name in self._INDEXED:
+            self._changed()
+
     @property
     def allowed_values(self):
         """Return a list of allowed values."""
-        if self._allowed_values is None:
-            self._allowed_values = ValueList()
+        if self._allowed_values is None and self.datatype:
+            # Shared with all dimensions of this datatype
+            self._allowed_values = self.datatype.allowed_values
+        elif self._allowed_values is None:
+            # Only published when complete, for other threads
+            allowed_values = ValueList()
             for val in self.scraper._fetch_allowed_values(self):
                 if isinstance(val, DimensionValue):
-                    self._allowed_values.append(val)
+                    allowed_values.append(val)
                 else:
-                    self._allowed_values.append(DimensionValue(val,
-                                                               Dimension()))
+                    allowed_values.append(DimensionValue(val, Dimension()))
+            self._allowed_values = allowed_values
         return self._allowed_values
 
+    def normalize(self, value):
+        """Return the standard value for a value in this dimension's dialect.
+
+        Values that are not found among the dialect's allowed values are
+        returned as they are, as unicode strings.
+        """
+        normalized_value = unicode(value)
+        if self.dialect and self.datatype:
+            if self.dialect in getattr(self.datatype, "dialects", []):
+                dialect_map = self._get_dialect_map(self.dialect)
+                normalized_value = dialect_map.get(normalized_value,
+                                                   normalized_value)
+        return normalized_value
+
+    def _get_dialect_map(self, dialect):
+        """Map every value in a dialect to the standard value.
+
+        Built once per dialect, from the allowed values. If a dialect
+        value belongs to more than one allowed value, the first match is
+        used. We do not support multiple matches. This is by design.
+        """
+        if dialect not in self._dialect_maps:
+            dialect_map = {}
+            for av in self.allowed_values:
+                # Not all allowed_value have all dialects
+                dialect_values = getattr(av, "dialects", {}).get(dialect)
+                for dialect_value in dialect_values or []:
+                    dialect_map.setdefault(dialect_value, av.value)
+            self._dialect_maps[dialect] = dialect_map
+        return self._dialect_maps[dialect]
+
 
 class ItemList(BaseScraperList):
     """A one dimensional list of items.
@@ -284,6 +936,7 @@ class Item(BaseScraperObject):
     parent = None  # Parent item
     _items = None  # ItemList with children
     _collection_path = None  # All ancestors
+    _UNPICKLED = BaseScraperObject._UNPICKLED | frozenset(["_lock"])
 
     def __init__(self, id_, label=None, blob=None):
         """Use blob to store any custom data."""
@@ -294,6 +947,25 @@ class Item(BaseScraperObject):
         else:
             self.label = label
         self._collection_path = deque([self])  # Will be overwritten when attached to an ItemList
+        self._lock = RLock()  # For loading children etc in stateless mode
+
+    def __setattr__(self, name, value):
+        super(Item, self).__setattr__(name, value)
+        if name in self._INDEXED:
+            self._changed()
+
+    def __setstate__(self, state):
+        super(Item, self).__setstate__(state)
+        self._lock = RLock()
+
+    def _select(self):
+        """Move the cursor here, unless the scraper is stateless.
+
+        Stateless scrapers fetch everything from the item given, so
+        items can be used in any order, and from several threads.
+        """
+        if not self.scraper.stateless and self.scraper.current_item is not self:
+            self._move_here()
 
     def _move_here(self):
         """Move the cursor to this item."""
@@ -360,27 +1032,34 @@ class Collection(Item):
     @property
     def items(self):
         """ItemList of children."""
-        if self.scraper.current_item is not self:
-            self._move_here()
-
+        self._select()
         if self._items is None:
-            self._items = ItemList()
-            self._items.scraper = self.scraper
-            self._items.collection = self
-            for i in self.scraper._fetch_itemslist(self):
-                i.parent = self
-                if i.type == TYPE_DATASET and i.dialect is None:
-                    i.dialect = self.scraper.dialect
-                self._items.append(i)
+            with self._lock:
+                if self._items is None:
+                    self._items = self._load_items()
         return self._items
 
+    def _load_items(self):
+        """Fetch the children of this collection, wherever the cursor is.
+
+        Only safe to call directly for stateless scrapers.
+        """
+        items = ItemList()
+        items.scraper = self.scraper
+        items.collection = self
+        for i in self.scraper._fetch_itemslist(self):
+            i.parent = self
+            if i.type == TYPE_DATASET and i.dialect is None:
+                i.dialect = self.scraper.dialect
+            items.append(i)
+        return items
+
     def __getitem__(self, key):
         """Provide bracket notation.
 
         collection["abc"] is shorthand for collection.items["abc"]
         """
-        if self.scraper.current_item is not self:
-            self._move_here()
+        self._select()
         try:
             return self.items[key]
         except IndexError:
@@ -395,15 +1074,10 @@ class Collection(Item):
 class Dataset(Item):
     """A dataset. Can be empty."""
 
-    _data = None  # We store one ResultSet for each unique query
     _dimensions = None
     dialect = None
     query = None
 
-    def __init__(self, id_, label=None, blob=None):
-        super(Dataset, self).__init__(id_, label, blob)
-        self._data = {}
-
     @property
     def items(self):
         """A dataset has no children."""
@@ -411,63 +1085,158 @@ class Dataset(Item):
 
     @property
     def _hash(self):
-        """Return a hash for the current query.
+        """Return a hash for the current query."""
+        return self._get_hash(self.query)
+
+    def _get_hash(self, query, kwargs=None):
+        """Return a hash for a query, and any keyword arguments to fetch().
 
+        Equivalent queries get the same hash, see canonical_query().
+        Callables (e.g. progress callbacks) are not part of the hash.
         This hash is _not_ a unique representation of the dataset!
         """
-        dump = dumps(self.query, sort_keys=True)
+        key = canonical_query(query)
+        kwargs = {k: v for k, v in (kwargs or {}).items() if not callable(v)}
+        if kwargs:
+            key = [key, kwargs]
+        dump = dumps(key, sort_keys=True, default=repr)
         if isinstance(dump, str):
             dump = dump.encode('utf-8')
         return md5(dump).hexdigest()
 
-    def fetch_next(self, query=None, **kwargs):
+    def _get_cached(self, hash_):
+        """Return the cached ResultSet for a query hash, or None.
+
+        ResultSets are kept in the scraper's cache, and the dataset
+        they belong to is part of the key. If the scraper has a
+        persistent cache, that is checked next.
+        """
+        resultset = self.scraper.cache.get((id(self), hash_))
+        persistent_cache = self.scraper.persistent_cache
+        if resultset is None and persistent_cache is not None:
+            dump = persistent_cache.get(self._persistent_key(hash_))
+            if dump is not None:
+                resultset = self._new_resultset()
+                resultset._load(dump)
+                self.scraper.cache[(id(self), hash_)] = resultset
+        return resultset
+
+    def _set_cached(self, hash_, resultset):
+        # The cached ResultSet refers to this dataset, so the id
+        # in the key can not be reused while the entry exists
+        self.scraper.cache[(id(self), hash_)] = resultset
+        persistent_cache = self.scraper.persistent_cache
+        if persistent_cache is not None:
+            persistent_cache[self._persistent_key(hash_)] = resultset._dump()
+
+    def _persistent_key(self, hash_):
+        """Key for the persistent cache, valid across processes."""
+        scraper = type(self.scraper)
+        return dumps([scraper.__module__ + "." + scraper.__name__,
+                      [item.id for item in self.path],
+                      hash_])
+
+    def _is_cacheable(self, kwargs):
+        """Check if results fetched with these kwargs can be cached."""
+        return not any(kwargs.get(k) for k in self.scraper.uncached_kwargs)
+
+    def _new_resultset(self):
+        """Return an empty ResultSet for this dataset."""
+        rs = self.scraper.resultset_class()
+        rs.dialect = self.dialect
+        rs.dataset = self
+        return rs
+
+    def fetch_next(self, query=None, cache=True, **kwargs):
         """Generator to yield data one row at a time.
         Yields a Result, not the entire ResultSet. The containing ResultSet
         can be accessed through `Result.resultset`, but be careful not to
         manipulate the ResultSet until it is populated (when this generator
         is empty), or you may see unexpected results.
+
+        `cache` decides what happens to the rows:
+         - True: Rows are kept in memory, and cached for this query.
+         - False: Rows are not kept at all. `Result.resultset` will
+           be empty. Use this to stream tables larger than memory.
+         - "disk": Rows are written to a temporary file as they are
+           yielded. The cached ResultSet reads them back from there.
+
+        The cache is only filled once the generator is exhausted.
         """
         if query:
             self.query = query
-
-        hash_ = self._hash
-        if hash_ in self._data:
-            for result in self._data[hash_]:
+        else:
+            # Another thread may change self.query while fetching
+            query = self.query
+
+        cacheable = self._is_cacheable(kwargs)
+        hash_ = self._get_hash(query, kwargs)
+        cached = self._get_cached(hash_) if cacheable else None
+        if cached is not None:
+            for result in cached:
                 yield result
+            return
 
-        if self.scraper.current_item is not self:
-            self._move_here()
+        self._select()
 
-        self._data[hash_] = ResultSet()
-        self._data[hash_].dialect = self.dialect
-        self._data[hash_].dataset = self
+        if cache == "disk":
+            rs = DiskResultSet()
+            rs.dialect = self.dialect
+            rs.dataset = self
+        else:
+            rs = self._new_resultset()
         for result in self.scraper._fetch_data(self,
-                                               query=self.query,
+                                               query=query,
                                                **kwargs):
-            self._data[hash_].append(result)
-            yield result
+            if not _is_batch(result):
+                if cache:
+                    rs.append(result)
+                else:
+                    rs._attach(result)
+                yield result
+            elif cache:
+                # A batch of results
+                start = len(rs)
+                rs.append_batch(result)
+                for i in range(start, len(rs)):
+                    yield rs[i]
+            else:
+                batch = ResultSet()
+                batch.dialect = self.dialect
+                batch.dataset = self
+                batch.append_batch(result)
+                for result in batch:
+                    yield result
+        if cache and cacheable:
+            self._set_cached(hash_, rs)
 
     def fetch(self, query=None, **kwargs):
         """Ask scraper to return data for the current dataset."""
         if query:
             self.query = query
+        else:
+            # Another thread may change self.query while fetching
+            query = self.query
 
-        hash_ = self._hash
-        if hash_ in self._data:
-            return self._data[hash_]
+        cacheable = self._is_cacheable(kwargs)
+        hash_ = self._get_hash(query, kwargs)
+        cached = self._get_cached(hash_) if cacheable else None
+        if cached is not None:
+            return cached
 
-        if self.scraper.current_item is not self:
-            self._move_here()
+        self._select()
 
-        rs = ResultSet()
-        rs.dialect = self.dialect
-        rs.dataset = self
+        rs = self._new_resultset()
         for result in self.scraper._fetch_data(self,
-                                               query=self.query,
+                                               query=query,
                                                **kwargs):
-            rs.append(result)
-        self._data[hash_] = rs
-        return self._data[hash_]
+            if _is_batch(result):
+                rs.append_batch(result)
+            else:
+                rs.append(result)
+        if cacheable:
+            self._set_cached(hash_, rs)
+        return rs
 
     @property
     def data(self):
@@ -478,17 +1247,22 @@ class Dataset(Item):
     def dimensions(self):
         """Available dimensions, if defined."""
         # First of all: Select this dataset
-        if self.scraper.current_item is not self:
-            self._move_here()
+        self._select()
 
         if self._dimensions is None:
-            self._dimensions = DimensionList()
-            for d in self.scraper._fetch_dimensions(self):
-                d.dataset = self
-                d.scraper = self.scraper
-                self._dimensions.append(d)
+            with self._lock:
+                if self._dimensions is None:
+                    self._dimensions = self._load_dimensions()
         return self._dimensions
 
+    def _load_dimensions(self):
+        dimensions = DimensionList()
+        for d in self.scraper._fetch_dimensions(self):
+            d.dataset = self
+            d.scraper = self.scraper
+            dimensions.append(d)
+        return dimensions
+
     @property
     def shape(self):
         """Compute the shape of the dataset as (rows, cols)."""
@@ -509,6 +1283,37 @@ class BaseScraper(Collection):
     }
 
     dialect = None
+    resultset_class = ResultSet  # Or ColumnarResultSet, for large tables
+
+    # Set to True if _fetch_itemslist, _fetch_dimensions and _fetch_data
+    # only depend on the item they are given, and not on the position of
+    # the cursor. Items are then used without moving the cursor, or
+    # firing hooks, and can be fetched from several threads.
+    stateless = False
+
+    # Keyword arguments to fetch() are part of the key of cached results.
+    # A true value for any of these skips the result cache, e.g. for
+    # arguments that should make every call ask the source again.
+    uncached_kwargs = ()
+
+    # Limits for the cache of query results. None means no limit.
+    cache_max_entries = None
+    cache_max_bytes = None
+    cache_ttl = None  # seconds
+    _cache = None
+    persistent_cache = None  # A PersistentResultCache, shared by processes
+
+    # HTTP settings, see statscraper.session
+    http_timeout = DEFAULT_TIMEOUT  # seconds
+    http_retries = 3
+    http_backoff_factor = 0.5
+    http_pool_maxsize = 10  # connections per host
+    http_headers = None
+    _session = None
+
+    # Seconds before cached metadata documents are revalidated
+    document_max_age = 3600
+    _documents = None
 
     @classmethod
     def on(cls, hook):
@@ -535,6 +1340,49 @@ class BaseScraper(Collection):
         """
         return self.items[key]
 
+    @property
+    def cache(self):
+        """Query results of all datasets in this scraper.
+
+        Can be replaced by any dictionary like object with a get() method.
+        """
+        if self._cache is None:
+            self._cache = ResultCache(max_entries=self.cache_max_entries,
+                                      max_bytes=self.cache_max_bytes,
+                                      ttl=self.cache_ttl)
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
+
+    @property
+    def session(self):
+        """A pooled HTTP session, for all requests made by this scraper."""
+        if self._session is None:
+            self._session = create_session(
+                timeout=self.http_timeout,
+                retries=self.http_retries,
+                backoff_factor=self.http_backoff_factor,
+                pool_maxsize=self.http_pool_maxsize,
+                headers=self.http_headers)
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    @property
+    def documents(self):
+        """A DocumentCache, for metadata that rarely changes."""
+        if self._documents is None:
+            self._documents = DocumentCache(max_age=self.document_max_age)
+        return self._documents
+
+    @documents.setter
+    def documents(self, documents):
+        self._documents = documents
+
     @property
     def items(self):
         """ItemList of collections or datasets at the current position.
@@ -622,18 +1470,63 @@ class BaseScraper(Collection):
         """Must be overriden by scraper authors, to yield dataset rows."""
         raise Exception("This scraper has no method for fetching data!")
 
+    def crawl(self, max_workers=8):
+        """Fetch every item below the current item, breadth first.
+
+        Returns a list of all collections and datasets found, each with
+        their children loaded. For stateless scrapers, the item lists of
+        each level are fetched in parallel, by up to `max_workers`
+        threads, without moving the cursor. Other scrapers walk the tree
+        with the cursor, and return it to the current item when done.
+        """
+        start = self.current_item
+        found = []
+        level = [start]
+        while level:
+            collections = [i for i in level if i.type == TYPE_COLLECTION]
+            if self.stateless and max_workers > 1 and len(collections) > 1:
+                pool = ThreadPool(min(max_workers, len(collections)))
+                try:
+                    itemslists = pool.map(self._crawl_items, collections)
+                finally:
+                    pool.terminate()
+            else:
+                itemslists = [self._crawl_items(c) for c in collections]
+            level = [item for items in itemslists for item in items]
+            found += level
+        if self.current_item is not start:
+            start._move_here()
+        return found
+
+    def _crawl_items(self, collection):
+        """Return the children of a collection, for crawl()."""
+        return collection.items
+
     @property
     def descendants(self):
         """Recursively return every dataset below current item."""
+        if self.stateless:
+            for i in self._iter_descendants(self.current_item):
+                yield i
+            return
         for i in self.current_item.items:
             self.move_to(i)
             if i.type == TYPE_COLLECTION:
-                for c in self.children:
+                for c in self.descendants:
                     yield c
             else:
                 yield i
             self.move_up()
 
+    def _iter_descendants(self, collection):
+        """Yield every dataset below a collection, without the cursor."""
+        for i in self._crawl_items(collection):
+            if i.type == TYPE_COLLECTION:
+                for d in self._iter_descendants(i):
+                    yield d
+            else:
+                yield i
+
     @property
     def children(self):
         """Former, misleading name for descendants."""
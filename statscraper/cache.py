@@ -0,0 +1,462 @@
+# encoding: utf-8
+""" Caching utilities shared by the base scraper and the scrapers.
+
+Nothing is cached on disk unless a cache directory is given:
+   export STATSCRAPER_CACHE_DIR="/path/to/cache/dir"
+
+Query results are kept in memory, in a ResultCache per scraper, and
+optionally on disk, in a PersistentResultCache shared by processes.
+Metadata documents are kept in a DocumentCache, in memory, and on disk
+if there is a cache directory. The same goes for compiled datatypes.
+"""
+import json
+import os
+import sys
+import time
+import sqlite3
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import md5
+from tempfile import mkstemp
+from threading import RLock
+from six.moves import cPickle as pickle
+import six
+
+CACHE_DIR_ENVVAR = "STATSCRAPER_CACHE_DIR"
+
+
+def get_cache_dir(*subdirs):
+    """Return a directory for cache files, creating it if needed.
+
+    Caching on disk is opt-in: Returns None unless STATSCRAPER_CACHE_DIR
+    is set, or if the directory can not be created.
+    """
+    base = os.getenv(CACHE_DIR_ENVVAR)
+    if not base:
+        return None
+    path = os.path.join(base, *subdirs)
+    try:
+        # Try and create directory before checking if it exists,
+        # to avoid race condition
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            return None
+    return path
+
+
+def write_atomic(path, data):
+    """Write bytes to a file, so that readers never see a partial file."""
+    fd, tmp_path = mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows will not rename onto an existing file
+            os.remove(path)
+            os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ResultCache(object):
+    """A dictionary like cache, with LRU eviction and expiring entries.
+
+    `max_entries` and `max_bytes` limit the size of the cache. The least
+    recently used entries are evicted first. Entries older than `ttl`
+    seconds are treated as missing. None means no limit.
+
+    The size of an entry is its `nbytes` attribute, if it has one (as
+    ResultSets and numpy arrays do), or sys.getsizeof() otherwise.
+
+    Counts of hits, misses and evictions are kept in `stats`.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 timer=time.time):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = RLock()
+        self._entries = OrderedDict()  # {key: (value, size, expires)}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = RLock()
+
+    @property
+    def stats(self):
+        """Return hit, miss and eviction counters, and the current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.nbytes,
+        }
+
+    def get(self, key, default=None):
+        """Return the value for a key, or default if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            # Move to the end, as the most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def __getitem__(self, key):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = _sizeof(value)
+        expires = None if self.ttl is None else self._timer() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would evict everything else, and then itself
+                self.evictions += 1
+                return
+            self._entries[key] = (value, size, expires)
+            self.nbytes += size
+            self._evict()
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key):
+        """Check for a key, without counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                return False
+            return entry is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __repr__(self):
+        return '<%s: %s entries, %s bytes>' % (type(self).__name__,
+                                               len(self), self.nbytes)
+
+    def _expired(self, entry):
+        return entry[2] is not None and entry[2] <= self._timer()
+
+    def _remove(self, key):
+        self.nbytes -= self._entries.pop(key)[1]
+
+    def _evict(self):
+        """Drop least recently used entries until within limits."""
+        while self._entries and (
+                (self.max_entries is not None
+                 and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None
+                    and self.nbytes > self.max_bytes)):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+def _sizeof(value):
+    """Return the approximate size of a value in bytes."""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, six.integer_types):
+        return nbytes
+    return sys.getsizeof(value)
+
+
+class PersistentResultCache(object):
+    """A cache of query results on disk, that processes can share.
+
+    Entries are stored compressed in an SQLite database, by default in
+    the statscraper cache directory. Writes are done in transactions,
+    so concurrent processes never see partial entries.
+
+    Entries older than `ttl` seconds are treated as missing. When the
+    entries take up more than `max_bytes`, the least recently used are
+    evicted.
+
+    Use it by setting `persistent_cache` on a scraper:
+
+      >>> SCB.persistent_cache = PersistentResultCache(ttl=24 * 3600)
+    """
+
+    FILE_NAME = "results-py%s.sqlite" % sys.version_info[0]
+
+    def __init__(self, path=None, ttl=None, max_bytes=None,
+                 timer=time.time):
+        if path is None:
+            cache_dir = get_cache_dir()
+            if cache_dir is None:
+                raise ValueError("No path was given, and %s is not set"
+                                 % CACHE_DIR_ENVVAR)
+            path = os.path.join(cache_dir, self.FILE_NAME)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._transaction() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS results (
+                          key TEXT PRIMARY KEY,
+                          data BLOB NOT NULL,
+                          size INTEGER NOT NULL,
+                          expires REAL,
+                          accessed REAL NOT NULL)""")
+            db.execute("""CREATE INDEX IF NOT EXISTS results_accessed
+                          ON results (accessed)""")
+
+    @property
+    def stats(self):
+        """Return hit, miss and eviction counters of this process."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    @contextmanager
+    def _transaction(self):
+        """Open the database, and lock it for writing until done.
+
+        A connection per transaction keeps this safe across threads.
+        """
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def get(self, key, default=None):
+        """Return the value for a key, or default if missing or expired."""
+        now = self._timer()
+        with self._transaction() as db:
+            row = db.execute("SELECT data, expires FROM results "
+                             "WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                db.execute("DELETE FROM results WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                db.execute("UPDATE results SET accessed = ? WHERE key = ?",
+                           (now, key))
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def __setitem__(self, key, value):
+        data = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        now = self._timer()
+        expires = None if self.ttl is None else now + self.ttl
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            self.evictions += 1
+            return
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO results "
+                       "(key, data, size, expires, accessed) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (key, sqlite3.Binary(data), len(data), expires, now))
+            db.execute("DELETE FROM results WHERE expires <= ?", (now,))
+            if self.max_bytes is not None:
+                self._evict(db)
+
+    def __delitem__(self, key):
+        with self._transaction() as db:
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def __contains__(self, key):
+        with self._transaction() as db:
+            row = db.execute("SELECT expires FROM results WHERE key = ?",
+                             (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > self._timer())
+
+    def __len__(self):
+        with self._transaction() as db:
+            return db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @property
+    def nbytes(self):
+        """Size of all entries, compressed."""
+        with self._transaction() as db:
+            return db.execute("SELECT COALESCE(SUM(size), 0) "
+                              "FROM results").fetchone()[0]
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute("DELETE FROM results")
+
+    def __repr__(self):
+        return '<%s: %s>' % (type(self).__name__, self.path)
+
+    def _evict(self, db):
+        """Drop least recently used entries until within max_bytes."""
+        nbytes = db.execute("SELECT COALESCE(SUM(size), 0) "
+                            "FROM results").fetchone()[0]
+        if nbytes <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM results "
+                                    "ORDER BY accessed").fetchall():
+            db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.evictions += 1
+            nbytes -= size
+            if nbytes <= self.max_bytes:
+                break
+
+
+class DocumentCache(object):
+    """A cache of JSON documents, such as API metadata, by url.
+
+    Documents younger than `max_age` seconds are used without asking
+    the server. Older documents are revalidated with a conditional
+    request, using their ETag or Last-Modified header, and only
+    downloaded again if they have changed.
+
+    Documents are kept in memory, and in the statscraper cache
+    directory, if caching on disk is enabled, so that they can be
+    reused by later processes. Set `persist` to False to only keep
+    them in memory.
+    """
+
+    def __init__(self, max_age=3600, persist=True, timer=time.time):
+        self.max_age = max_age
+        self.path = get_cache_dir("documents") if persist else None
+        self._timer = timer
+        self._lock = RLock()
+        self._documents = {}  # {url: document}
+        self.hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = RLock()
+
+    def get_json(self, session, url, before_request=None):
+        """Return the JSON document at `url`, fetched with `session`.
+
+        `before_request` is called before any request is made, e.g. to
+        wait for a rate limit.
+        """
+        document = self._get_document(url)
+        now = self._timer()
+        if document is not None and now - document["fetched"] < self.max_age:
+            self.hits += 1
+            return document["data"]
+
+        headers = {}
+        if document is not None:
+            if document["etag"]:
+                headers["If-None-Match"] = document["etag"]
+            if document["last_modified"]:
+                headers["If-Modified-Since"] = document["last_modified"]
+        if before_request is not None:
+            before_request()
+        response = session.get(url, headers=headers)
+
+        if document is not None and response.status_code == 304:
+            self.revalidations += 1
+            document["fetched"] = now
+        elif response.status_code == 200:
+            self.downloads += 1
+            document = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": now,
+                "data": response.json(),
+            }
+        else:
+            # Not cached. This will raise an error, unless it is JSON
+            return response.json()
+        self._set_document(url, document)
+        return document["data"]
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            if self.path is not None:
+                for file_name in os.listdir(self.path):
+                    if file_name.endswith(".json"):
+                        os.remove(os.path.join(self.path, file_name))
+
+    def _get_file(self, url):
+        if self.path is None:
+            return None
+        return os.path.join(self.path,
+                            md5(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _get_document(self, url):
+        with self._lock:
+            if url in self._documents:
+                return self._documents[url]
+        file_path = self._get_file(url)
+        if file_path is None or not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, "rb") as f:
+                document = json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            # Removed or corrupt: Will be downloaded again
+            return None
+        if document.get("url") != url:
+            return None
+        with self._lock:
+            return self._documents.setdefault(url, document)
+
+    def _set_document(self, url, document):
+        with self._lock:
+            self._documents[url] = document
+        file_path = self._get_file(url)
+        if file_path is not None:
+            try:
+                write_atomic(file_path, json.dumps(document).encode("utf-8"))
+            except (IOError, OSError):
+                # A read only cache dir just means downloading again
+                pass
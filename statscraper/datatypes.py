@@ -1,20 +1,139 @@
 # encoding: utf-8
 """ Contains code for parsing datatypes from the statscraper-datatypes repo
+
+Datatypes and their allowed values are parsed once per process, and
+shared by all Datatype objects with the same id. Value files are only
+read when the allowed values of a datatype are first used.
+
+If a statscraper cache directory is set, parsed csv files are also
+kept there in a compiled (pickled) form, and reused by later processes
+for as long as the csv files are unchanged. See statscraper.cache for
+how to enable it.
 """
 from glob import iglob
+from hashlib import md5
 from itertools import chain
+from threading import RLock
+from six.moves import cPickle as pickle
 from csvkit import DictReader
 from csvkit import reader as CsvReader
 from .exceptions import NoSuchDatatype
 from .DimensionValue import DimensionValue
 from .ValueList import ValueList
 from .compat import StringIO
+from .cache import get_cache_dir, write_atomic
 import os
+import sys
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 DATATYPES_FILE = os.path.join(DIR_PATH, "datatypes", "datatypes.csv")
 VALUE_DELIMITOR = ','
 
+_lock = RLock()
+_datatypes = None  # {id: row in datatypes.csv}
+_allowed_values = {}  # {id: (ValueList, dialects)}
+_compiled = None  # {csv file path: (file signature, parsed content)}
+_compiled_changed = False
+
+
+def _get_datatypes():
+    """Return all rows of datatypes.csv by id, parsing the file once."""
+    global _datatypes
+    with _lock:
+        if _datatypes is None:
+            datatypes = {}
+            for row in _read_compiled(DATATYPES_FILE, _parse_datatypes_file):
+                datatypes.setdefault(row["id"], row)
+            _save_compiled()
+            _datatypes = datatypes
+    return _datatypes
+
+
+def _parse_datatypes_file(path):
+    with open(path, 'r') as csvfile:
+        return [dict(row) for row in DictReader(csvfile)]
+
+
+def _parse_values_file(path):
+    """Return the dialects and the rows of a file with allowed values.
+
+    Each row is a tuple of (id, label, {dialect: [values] or None}).
+    """
+    rows = []
+    with open(path, 'r') as csvfile:
+        reader = DictReader(csvfile)
+        dialect_names = [x
+                         for x in reader.fieldnames
+                         if x.startswith("dialect:")]
+        for row in reader:
+            dialects = {d[8:]: None for d in dialect_names}
+            for d in dialect_names:
+                f = StringIO(row[d].encode("utf-8"))
+                csvreader = CsvReader(f,
+                                      delimiter=VALUE_DELIMITOR,
+                                      skipinitialspace=True,
+                                      strict=True)
+                try:
+                    dialects[d[8:]] = next(csvreader)
+                except Exception:
+                    continue
+            rows.append((row["id"], row["label"], dialects))
+    return ([d[8:] for d in dialect_names], rows)
+
+
+def _get_compiled_file():
+    """Return the path of the compiled csv files, or None if disabled.
+
+    Pickles are not portable between Python 2 and 3, and every
+    installation gets a file of its own.
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return None
+    install_id = md5(DIR_PATH.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, "datatypes-py%s-%s.pickle"
+                        % (sys.version_info[0], install_id))
+
+
+def _read_compiled(path, parse):
+    """Return a parsed csv file, from the compiled cache if unchanged."""
+    global _compiled, _compiled_changed
+    if _compiled is None:
+        _compiled = {}
+        compiled_file = _get_compiled_file()
+        if compiled_file and os.path.exists(compiled_file):
+            try:
+                with open(compiled_file, 'rb') as f:
+                    _compiled = pickle.load(f)
+            except Exception:
+                # Corrupt or incompatible: Will be rebuilt
+                _compiled = {}
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime, stat.st_size)
+    if path in _compiled and _compiled[path][0] == signature:
+        return _compiled[path][1]
+    data = parse(path)
+    _compiled[path] = (signature, data)
+    _compiled_changed = True
+    return data
+
+
+def _save_compiled():
+    """Write the compiled cache to disk, if anything new was parsed."""
+    global _compiled_changed
+    if not _compiled_changed:
+        return
+    compiled_file = _get_compiled_file()
+    if compiled_file:
+        try:
+            write_atomic(compiled_file,
+                         pickle.dumps(_compiled, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            # A read only cache dir just means parsing csv files again
+            pass
+    _compiled_changed = False
+
 
 class Datatype(object):
     """Represent a datatype, initiated by id."""
@@ -22,47 +141,47 @@ class Datatype(object):
     def __init__(self, id):
         """Id is a datatype from datatypes.csv."""
         self.id = id
-        self.allowed_values = ValueList()
-
-        data = None
-        with open(DATATYPES_FILE, 'r') as csvfile:
-            reader = DictReader(csvfile)
-            for row in reader:
-                if row["id"] == id:
-                    data = row
-                    break
+
+        data = _get_datatypes().get(id)
         if data is None:
             raise(NoSuchDatatype)
         self.value_type = data["value_type"]
         self.description = data["description"]
-        domain = data["allowed_values"]
-        if domain:
-            for file_ in self._get_csv_files(domain):
-                with open(file_, 'r') as csvfile:
-                    reader = DictReader(csvfile)
-                    dialect_names = [x
-                                     for x in reader.fieldnames
-                                     if x.startswith("dialect:")]
-                    self.dialects = [d[8:] for d in dialect_names]
-                    for row in reader:
-                        value = DimensionValue(row["id"],
-                                               self,
-                                               label=row["label"])
-                        dialects = {x: None for x in self.dialects}
-
-                        for d in dialect_names:
-                            f = StringIO(row[d].encode("utf-8"))
-                            csvreader = CsvReader(f,
-                                                  delimiter=VALUE_DELIMITOR,
-                                                  skipinitialspace=True,
-                                                  strict=True)
-                            try:
-                                values = csvreader.next()
-                            except Exception:
-                                continue
-                            dialects[d[8:]] = values
-                        value.dialects = dialects
-                        self.allowed_values.append(value)
+        self.domain = data["allowed_values"]
+
+    @property
+    def allowed_values(self):
+        """Allowed values, shared by every Datatype with this id.
+
+        The list is read only.
+        """
+        return self._get_allowed_values()[0]
+
+    @property
+    def dialects(self):
+        """Dialects available for the allowed values."""
+        return self._get_allowed_values()[1]
+
+    def _get_allowed_values(self):
+        with _lock:
+            if self.id not in _allowed_values:
+                _allowed_values[self.id] = self._parse_allowed_values()
+        return _allowed_values[self.id]
+
+    def _parse_allowed_values(self):
+        allowed_values = ValueList()
+        dialects = []
+        if self.domain:
+            for file_ in self._get_csv_files(self.domain):
+                file_dialects, rows = _read_compiled(file_, _parse_values_file)
+                dialects += [d for d in file_dialects if d not in dialects]
+                for id_, label, value_dialects in rows:
+                    value = DimensionValue(id_, self, label=label)
+                    value.dialects = {d: (list(v) if v is not None else v)
+                                      for d, v in value_dialects.items()}
+                    allowed_values.append(value)
+            _save_compiled()
+        return (allowed_values.freeze(), dialects)
 
     def _get_csv_files(self, domain):
         domain = os.path.join(*domain.split("/"))
@@ -8,17 +8,54 @@
         # ...or:
         scraper = PXWeb()
         scraper.base_url = "http://api.example.com/"
+
+    Queries that are too large for the API are split into smaller ones,
+    along the dimensions with most values. The limit is read from the
+    API config, or can be set with `max_values`.
+
+    Split queries are run in parallel, by `max_workers` threads. Requests
+    are limited to the rate allowed by the API config (maxCalls per
+    timeWindow seconds), or by `max_calls` and `time_window`.
+
+    Metadata (the tree of tables, and their variables) is cached, see
+    BaseScraper.documents.
+
+    Data is requested in the PX-Web json format by default. APIs that
+    support json-stat2 can be queried with that instead, which is much
+    smaller, and faster to parse:
+        scraper.response_format = "json-stat2"
 """
+from codecs import getincrementaldecoder
+from itertools import product
+from json import JSONDecoder
+from json.decoder import WHITESPACE
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
 
-import requests
-from statscraper import (BaseScraper, Collection, Result,
-                         Dataset, Dimension, InvalidData)
+from statscraper import (BaseScraper, Collection,
+                         Dataset, Dimension, InvalidData, VALUE_KEY)
 from statscraper.compat import JSONDecodeError
+from statscraper.session import get_rate_limiter
+from requests.exceptions import RequestException
+
+
+CHUNK_SIZE = 64 * 1024  # bytes read at a time from responses
+BATCH_ROWS = 10000  # rows decoded at a time from json responses
 
 
 class PXWeb(BaseScraper):
 
     base_url = None  # API endpoint
+    stateless = True  # Items are addressed by their path
+    max_values = None  # Max cells per query, None to ask the API
+    max_calls = None  # Max requests per time_window, None to ask the API
+    time_window = None  # seconds
+    max_workers = 4  # Threads for running split queries
+    response_format = "json"  # or "json-stat2"
+    _config = None
+    _rate_limiter = None
 
     @BaseScraper.on("init")
     def _get_args(self, *args, **kwargs):
@@ -35,8 +72,13 @@ class PXWeb(BaseScraper):
         path = "/".join([x.blob["id"] for x in item.path])
         return "/".join([self.base_url, path])
 
+    def _get_json(self, url):
+        """Get a metadata document, from the document cache if unchanged."""
+        return self.documents.get_json(
+            self.session, url, before_request=self._wait_for_rate_limit)
+
     def _fetch_itemslist(self, item):
-        data = requests.get(self._api_path(item)).json()
+        data = self._get_json(self._api_path(item))
 
         for d in data:
             if d["type"] == "l":
@@ -45,7 +87,7 @@ class PXWeb(BaseScraper):
                 yield Dataset(d["id"], label=d["text"], blob=d)
 
     def _fetch_dimensions(self, dataset):
-        data = requests.get(self._api_path(dataset)).json()
+        data = self._get_json(self._api_path(dataset))
         try:
             for d in data["variables"]:
                 yield Dimension(d["code"],
@@ -55,9 +97,111 @@ class PXWeb(BaseScraper):
         except KeyError:
             yield None
 
-    def _fetch_data(self, dataset, query, filtertype="item"):
+    @property
+    def config(self):
+        """The API config, with e.g. maxValues, maxCalls and timeWindow.
+
+        Empty if the API does not provide one.
+        """
+        if self._config is None:
+            # The config is at the API root, with the database id removed
+            # e.g. http://api.scb.se/OV0104/v1/doris/sv/?config
+            root = self.base_url.rstrip("/").rsplit("/", 1)[0]
+            try:
+                self._config = self.session.get(root + "/?config").json()
+            except (RequestException, JSONDecodeError):
+                self._config = {}
+        return self._config
+
+    def _wait_for_rate_limit(self):
+        """Block until the API allows another request."""
+        if self._rate_limiter is None:
+            max_calls = self.max_calls or self.config.get("maxCalls")
+            time_window = self.time_window or self.config.get("timeWindow")
+            if not (max_calls and time_window):
+                return
+            self._rate_limiter = get_rate_limiter(self.base_url,
+                                                  max_calls, time_window)
+        self._rate_limiter.wait()
+
+    def _get_max_values(self):
+        if self.max_values is not None:
+            return self.max_values
+        return self.config.get("maxValues")
+
+    def _split_query(self, query, filtertype="item", dimensions=()):
+        """Split a query into queries of at most max_values cells.
+
+        The dimension with most values in each query is split first.
+        Only item filters are split, as the number of values for
+        other filters is not known before querying.
+        `dimensions` are those of the dataset. Any that the query leaves
+        out are returned in full, and count towards every query.
+        Returns a list of queries, in a stable order.
+        """
+        max_values = self._get_max_values()
+        query = [(key, value if isinstance(value, list) else [value])
+                 for key, value in query.items()]
+        if filtertype != "item" or not max_values:
+            return [dict(query)]
+
+        chunk_sizes = {key: len(values) for key, values in query}
+        for dimension in dimensions:
+            if dimension.id not in chunk_sizes:
+                max_values //= len(dimension.allowed_values) or 1
+        max_values = max(1, max_values)
+        cells = 1
+        for size in chunk_sizes.values():
+            cells *= size
+        while cells > max_values:
+            key = max((k for k, v in query), key=lambda k: chunk_sizes[k])
+            if chunk_sizes[key] <= 1:
+                break
+            rest = cells // chunk_sizes[key]
+            chunk_sizes[key] = max(1, max_values // rest)
+            cells = rest * chunk_sizes[key]
+
+        chunks = []
+        for key, values in query:
+            size = chunk_sizes[key] or 1
+            chunks.append([(key, values[i:i + size])
+                           for i in range(0, len(values) or 1, size)])
+        return [dict(subquery) for subquery in product(*chunks)]
+
+    def _fetch_data(self, dataset, query, filtertype="item", ordered=True):
+        """Yield results, running split queries in parallel.
+
+        With `ordered=False`, the results of each query are yielded as
+        soon as it completes, instead of in the order of the queries.
+        """
         if query is None:
             query = {}
+        dimensions = dataset.dimensions if dataset is not None else ()
+        queries = self._split_query(query, filtertype, dimensions)
+        if len(queries) == 1 or self.max_workers <= 1:
+            for subquery in queries:
+                for result in self._fetch_query(dataset, subquery,
+                                                filtertype):
+                    yield result
+            return
+
+        def fetch(subquery):
+            return list(self._fetch_query(dataset, subquery, filtertype))
+
+        pool = ThreadPool(min(self.max_workers, len(queries)))
+        try:
+            if ordered:
+                batches = pool.imap(fetch, queries)
+            else:
+                batches = pool.imap_unordered(fetch, queries)
+            for batch in batches:
+                for result in batch:
+                    yield result
+        finally:
+            pool.terminate()
+
+    def _fetch_query(self, dataset, query, filtertype):
+        """Yield the results of a single query to the API."""
         body = {
             'query': [{
                 'code': key,
@@ -66,31 +210,218 @@ class PXWeb(BaseScraper):
                     # value can be a list or a value
                     'values': value if isinstance(value, list) else [value]
                 }
-            } for key, value in query.iteritems()],
+            } for key, value in query.items()],
             'response': {
-                'format': "json"
+                'format': self.response_format
             }
         }
+        if self.response_format == "json-stat2":
+            yield self._fetch_json_stat(dataset, body)
+            return
+        elif self.response_format != "json":
+            raise ValueError("Unsupported response format: %s"
+                             % self.response_format)
+
+        self._wait_for_rate_limit()
+        raw = self.session.post(self._api_path(dataset), json=body,
+                                stream=True)
+        try:
+            # The response is parsed as it is downloaded, and decoded
+            # in batches of at most BATCH_ROWS rows
+            raw_return_dimension = None
+            rows = []
+            for key, value in iter_json_stream(
+                    raw.iter_content(chunk_size=CHUNK_SIZE), "data"):
+                if key == "columns":
+                    # All available dimensions are not always returned.
+                    # What is returned depends on the query
+                    # Filter out dimensions only
+                    raw_return_dimension = [x for x in value
+                                            if x["type"] != "c"]
+                elif key == "data":
+                    rows.append(value)
+                else:
+                    continue
+                # Rows can only be decoded once the columns are known
+                if len(rows) >= BATCH_ROWS and \
+                        raw_return_dimension is not None:
+                    yield decode_rows(raw_return_dimension, rows)
+                    rows = []
+            if rows:
+                yield decode_rows(raw_return_dimension or [], rows)
+        except JSONDecodeError:
+            raise InvalidData("""No valid response from PX Web.
+Check your query for spelling errors, or try reducing the size.
+This error is frequently due to a too large result being requested.""")
+        finally:
+            raw.close()
+
+    def _fetch_json_stat(self, dataset, body):
+        """Return the results of a json-stat2 query, as a batch."""
+        self._wait_for_rate_limit()
+        raw = self.session.post(self._api_path(dataset), json=body)
         try:
-            raw = requests.post(self._api_path(dataset), json=body)
             data = raw.json()
         except JSONDecodeError:
             raise InvalidData("""No valid response from PX Web.
 Check your query for spelling errors, or try reducing the size.
 This error is frequently due to a too large result being requested.""")
+        return decode_json_stat(data)
+
+
+def decode_rows(raw_return_dimension, rows):
+    """Decode rows from the PX-Web json format into a batch of results.
+
+    Returns an OrderedDict of columns: The values, and a Categorical
+    for each dimension. Each row has one value for each content.
+    """
+    counts = np.array([len(row[u"values"]) for row in rows], dtype=np.intp)
+    columns = OrderedDict([
+        (VALUE_KEY, [value for row in rows for value in row[u"values"]]),
+    ])
+    # 'key' contains one value for each dimension,
+    # always preserving order.
+    keys = [row[u"key"] for row in rows]
+    for i, d in enumerate(raw_return_dimension):
+        codes, categories = pd.factorize(
+            np.array([key[i] for key in keys], dtype=object))
+        columns[d["code"]] = pd.Categorical.from_codes(
+            np.repeat(codes, counts), categories)
+    return columns
+
+
+def decode_json_stat(data):
+    """Decode a json-stat2 dataset into a batch of results.
+
+    Returns an OrderedDict of columns: The values, and a Categorical
+    of codes for each dimension. Like in the PX-Web json format, the
+    contents (metric) dimension is left out. Values missing from a
+    sparse value object are left out.
+    """
+    ids = data["id"]
+    size = data["size"]
+    value = data["value"]
+    if isinstance(value, dict):
+        # Sparse values, by index
+        indexes = np.array(sorted(int(i) for i in value), dtype=np.intp)
+        values = [value[str(i)] for i in indexes]
+    else:
+        indexes = np.arange(len(value), dtype=np.intp)
+        values = value
+
+    # Row major: The last dimension changes fastest
+    codes = np.unravel_index(indexes, size) if len(ids) else []
+    metrics = data.get("role", {}).get("metric", [])
+    columns = OrderedDict([(VALUE_KEY, values)])
+    for id_, dimension_codes in zip(ids, codes):
+        if id_ in metrics:
+            continue
+        index = data["dimension"][id_]["category"].get("index")
+        if index is None:
+            # A single category, with no index
+            categories = list(data["dimension"][id_]["category"]["label"])
+        elif isinstance(index, dict):
+            categories = sorted(index, key=index.get)
+        else:
+            categories = index
+        columns[id_] = pd.Categorical.from_codes(dimension_codes, categories)
+    return columns
+
+
+def iter_json_stream(chunks, array_key):
+    """Parse a JSON object incrementally, from chunks of utf-8 bytes.
+
+    Yields (key, value) for each member of the object, except for
+    `array_key`, where (array_key, item) is yielded for each item in
+    the array, as soon as it is parsed. Raises JSONDecodeError on
+    invalid or incomplete JSON.
+    """
+    stream = _JSONStream(chunks)
+    stream.expect("{")
+    if stream.expect('"}') == "}":
+        return
+    while True:
+        stream.pos -= 1  # Let the decoder read the opening quote
+        key = stream.value()
+        stream.expect(":")
+        if key == array_key:
+            stream.expect("[")
+            stream.skip_whitespace()
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield (key, stream.value())
+                    if stream.expect(",]") == "]":
+                        break
+        else:
+            yield (key, stream.value())
+        if stream.expect(",}") == "}":
+            return
+        stream.expect('"')
+
+
+class _JSONStream(object):
+    """A buffer of text decoded from chunks of utf-8 bytes."""
+
+    NUMBER_CHARS = u"0123456789.eE+-"
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = JSONDecoder()
+        self.text_decoder = getincrementaldecoder("utf-8-sig")()  # No BOM
+        self.buffer = u""
+        self.pos = 0
+        self.exhausted = False
+
+    def read(self):
+        """Add text from the next chunk. False at the end of the data."""
+        if self.exhausted:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            text = self.text_decoder.decode(b"", True)
+        else:
+            text = self.text_decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.read():
+                return
+
+    def peek(self):
+        """Return the next char, or None at the end of the data."""
+        if self.pos < len(self.buffer):
+            return self.buffer[self.pos]
+
+    def expect(self, chars):
+        """Skip whitespace, and consume the next char, if in `chars`."""
+        self.skip_whitespace()
+        char = self.peek()
+        if char is None or char not in chars:
+            raise JSONDecodeError("Expected one of %s, got %r" % (chars, char),
+                                  self.buffer, self.pos)
+        self.pos += 1
+        return char
 
-        # All available dimensions are not always returned.
-        # What is returned depends on the query
-        raw_return_dimension = data["columns"]
-        # Filter out dimensions only
-        raw_return_dimension = [x for x in raw_return_dimension if x["type"] != "c"]
-
-        for row in data[u"data"]:
-            for value in row[u"values"]:
-                dimensions = {}
-                # 'key' contains one value for each dimension,
-                # always preserving order.
-                for d, v in zip(raw_return_dimension, row[u"key"]):
-                    dimensions[d["code"]] = v
-
-                yield Result(value, dimensions=dimensions)
+    def value(self):
+        """Parse the next complete JSON value."""
+        self.skip_whitespace()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.read():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in next chunk
+            if (end == len(self.buffer)
+                    or self.buffer[end] in self.NUMBER_CHARS) and self.read():
+                continue
+            self.pos = end
+            return obj
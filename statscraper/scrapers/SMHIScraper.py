@@ -1,15 +1,28 @@
 # encoding: utf-8
-try:
-    import StringIO
-except ImportError:
-    import io as StringIO
-
-import requests
-import csvkit as csv
-from datetime import datetime
+""" A scraper for the SMHI open data APIs.
+
+    Observations can be fetched incrementally, by passing
+    `incremental=True` to fetch(). The observations of each station are
+    then kept on disk, in an ObservationStore, and only periods covering
+    the time since the last stored observation are downloaded:
+        dataset.fetch({"station": u"Abisko"}, incremental=True)
+
+    The store is kept in the statscraper cache directory (see
+    statscraper.cache), or in a directory of your choice:
+        scraper.store = ObservationStore("/path/to/observations")
+"""
+import os
+import sys
+from io import BytesIO
+import pandas as pd
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 from bs4 import BeautifulSoup
+from six.moves import cPickle as pickle
 
-from statscraper import BaseScraper, Collection, Dimension, Dataset, Result, ResultSet, NoSuchItem, DimensionValue
+from statscraper import BaseScraper, Collection, Dimension, Dataset, Result, ResultSet, NoSuchItem, DimensionValue, VALUE_KEY
+from statscraper.cache import get_cache_dir, write_atomic
 
 VERSION = "1.0"
 # LEVELS = ["api","parameter"]
@@ -19,16 +32,56 @@ PERIODS = [
     "latest-day",
     "latest-months",
 ]
+# Periods that can be used to update stored observations, and the time
+# they are known to cover, counted back from now (UTC).
+LATEST_PERIODS = [
+    ("latest-hour", timedelta(hours=1)),
+    ("latest-day", timedelta(days=1)),
+    ("latest-months", timedelta(days=90)),
+]
+# The corrected archive ends about three months back. Stored observations
+# older than that, that are not corrected, are replaced by the archive,
+# which is checked at most once per ARCHIVE_CHECK_INTERVAL.
+ARCHIVE_DELAY = timedelta(days=90)
+ARCHIVE_CHECK_INTERVAL = timedelta(days=1)
+QUALITY_COLUMN = u"Kvalitet"
+CHUNK_SIZE = 16 * 1024  # bytes read at a time, when looking for columns
+
+_columns_lock = Lock()
+_columns_locks = {}  # {parameter url: Lock}
+_columns = {}  # {parameter url: columns of its data files}
 
 
 class SMHI(BaseScraper):
     base_url = "http://opendata.smhi.se/apidocs/"
+    stateless = True  # Items are fetched from their own urls
+    max_workers = 8  # Threads for downloading csv files
+    http_pool_maxsize = max_workers
+    progress = None  # Default progress callback, see _fetch_data
+    uncached_kwargs = ("incremental",)  # Stored series are always updated
+    document_max_age = 900  # Station lists change as new data arrives
+    _store = None
+
+    @property
+    def store(self):
+        """An ObservationStore, for incremental fetches."""
+        if self._store is None:
+            self._store = ObservationStore()
+        return self._store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
+
+    def _get_json(self, url):
+        """Get an API document, from the document cache if unchanged."""
+        return self.documents.get_json(self.session, url)
 
     def _fetch_itemslist(self, current_item):
         """ Get a all available apis
         """
         if current_item.is_root:
-            html = requests.get(self.base_url).text
+            html = self.session.get(self.base_url).text
             soup = BeautifulSoup(html, 'html.parser')
             for item_html in soup.select(".row .col-md-6"):
                 try:
@@ -38,7 +91,7 @@ class SMHI(BaseScraper):
                 yield API(label, blob=item_html)
         else:
             # parameter = current_item.parent
-            # data = requests.get(parameter.url)
+            # data = self.session.get(parameter.url)
             for resource in current_item.json["resource"]:
                 label = u"{}, {}".format(resource["title"], resource["summary"])
                 yield SMHIDataset(label, blob=resource)
@@ -54,8 +107,7 @@ class SMHI(BaseScraper):
         yield(Dimension("period", allowed_values=PERIODS))
         yield(Dimension("parameter"))
 
-        example_data = parameter._get_example_csv()
-        for dim in example_data.columns:
+        for dim in parameter._get_columns():
             yield(Dimension(dim))
 
 
@@ -67,11 +119,24 @@ class SMHI(BaseScraper):
         else:
             yield None
 
-    def _fetch_data(self, dataset, query={}, include_inactive_stations=False):
+    def _fetch_data(self, dataset, query=None, include_inactive_stations=False,
+                    ordered=True, progress=None, incremental=False):
         """ Should yield dataset rows
+
+        One csv file is downloaded per station and period, by up to
+        `max_workers` threads. With `ordered=False`, the data of each
+        file is yielded as soon as it is downloaded, instead of in the
+        order of the query.
+
+        `progress`, if given, is called as progress(done, total, url,
+        status_code) after each download.
+
+        With `incremental=True`, the stored observations of each station
+        are updated (see _update_station), and yielded. The period of the
+        query is ignored.
         """
-        data = []
-        parameter = dataset
+        # Completed below, without touching the query of the dataset
+        query = dict(query or {})
         station_dim = dataset.dimensions["station"]
         all_stations = station_dim.allowed_values
         # Step 1: Prepare query
@@ -86,7 +151,8 @@ class SMHI(BaseScraper):
             if not isinstance(query["station"], list):
                 query["station"] = [query["station"]]
             # Make sure that the queried stations actually exist
-            query["station"] = [ all_stations.get_by_label(x) for x in query["station"]]
+            query["station"] = [station_dim.get_station(x)
+                                for x in query["station"]]
 
         if "period" not in query:
             # TODO: I'd prepare to do dataset.get("period").allowed_values here
@@ -102,42 +168,260 @@ class SMHI(BaseScraper):
 
 
         # Step 3: Get data
-        n_queries = len(query["station"]) * len(query["period"])
-        counter = 0
-        print("Fetching data with {} queries.".format(n_queries))
-        for station in query["station"]:
-            for period in query["period"]:
-                url = dataset.url\
-                    .replace(".json", "/station/{}/period/{}/data.csv"\
-                        .format(station.key, period))
-                print("/GET {} ".format(url))
-                r = requests.get(url)
+        if incremental and self.store.path is None:
+            raise ValueError("Incremental fetches need a directory for "
+                             "the ObservationStore, see the module doc")
+        if incremental:
+            jobs = [(station,) for station in query["station"]]
+            fetch = self._update_station
+        else:
+            jobs = [(station, period)
+                    for station in query["station"]
+                    for period in query["period"]]
+            fetch = self._fetch_csv
+        if progress is None:
+            progress = self.progress
+        for frame in self._fetch_frames(dataset, jobs, ordered, progress,
+                                        fetch):
+            yield frame
+
+    def _fetch_frames(self, dataset, jobs, ordered, progress, fetch=None):
+        """Download (station, period) csv files, `max_workers` at a time.
+
+        `fetch(dataset, *job)` does the work for each job, and defaults
+        to _fetch_csv. Yields a DataFrame for each job with data.
+        """
+        if fetch is None:
+            fetch = self._fetch_csv
+        total = len(jobs)
+        done = [0]  # Only updated from this thread
+
+        def report(url, status):
+            done[0] += 1
+            if progress is not None:
+                progress(done[0], total, url, status)
+
+        if total == 1 or self.max_workers <= 1:
+            for job in jobs:
+                url, status, frame = fetch(dataset, *job)
+                report(url, status)
+                if frame is not None:
+                    yield frame
+            return
+
+        def run(job):
+            return fetch(dataset, *job)
+
+        pool = ThreadPool(min(self.max_workers, total))
+        try:
+            if ordered:
+                responses = pool.imap(run, jobs)
+            else:
+                responses = pool.imap_unordered(run, jobs)
+            for url, status, frame in responses:
+                report(url, status)
+                if frame is not None:
+                    yield frame
+        finally:
+            pool.terminate()
+
+    def _fetch_csv(self, dataset, station, period):
+        """Download the data of a station and period.
+
+        Returns (url, status code, DataFrame or None). A 404 means that
+        there is no data for this period.
+        """
+        parameter = dataset
+        url = dataset.url\
+            .replace(".json", "/station/{}/period/{}/data.csv"\
+                .format(station.key, period))
+        r = self.session.get(url)
 
-                if r.status_code == 200:
-                    raw_data = DataCsv().from_string(r.content).to_dictlist()
+        if r.status_code == 200:
+            frame = DataCsv().from_string(r.content).frame
+            if not len(frame):
+                return (url, r.status_code, None)
+
+            # TODO: This is a very hard coded parse function
+            # Expects the value in the column named as the parameter
+            # Yield all rows of the file as one batch
+            value_col = parameter.id.split(",")[0]
+            frame[VALUE_KEY] = frame.pop(value_col).astype(float)
+            frame["parameter"] = parameter.id
+            frame["station"] = station.label
+            frame["station_key"] = station.key
+            frame["period"] = period
+            return (url, r.status_code, frame)
+
+        elif r.status_code == 404:
+            return (url, r.status_code, None)
+        else:
+            raise Exception("Connection error for {}".format(url))
+
+    def _update_station(self, dataset, station):
+        """Update the stored observations of a station, and return them.
+
+        Nothing is downloaded if the station has not been updated since
+        the last time. Otherwise the shortest period covering the time
+        since the last stored observation is downloaded (or the next one,
+        if it is not available for this parameter), or everything, if
+        that was too long ago. The corrected archive is downloaded again
+        when it may cover stored observations that were not corrected
+        (see archive_due). Returns (url, status code, DataFrame or None),
+        for the last download.
+        """
+        key = (dataset.parent.key, dataset.key, station.key)
+        state, stored = self.store.get(*key)
+        url = status = None
+        if state is not None and state["updated"] == station.blob["updated"]:
+            return (url, status, stored)
+
+        now = datetime.utcnow()
+        frames = [stored]
+        tried = set()
+        periods = ["latest-months", "corrected-archive"]  # Everything
+        last = state["last"] if state is not None else None
+        for period in covering_periods(last, now):
+            url, status, frame = self._fetch_csv(dataset, station, period)
+            tried.add(period)
+            if status != 404:
+                frames.append(frame)
+                periods = []
+                break
+        if not periods and archive_due(state, now):
+            periods = ["corrected-archive"]
+        # The archive is listed last, to win over uncorrected values
+        # where they overlap
+        archive_checked = state.get("archive_checked") if state else None
+        for period in periods:
+            if period in tried:
+                continue
+            url, status, frame = self._fetch_csv(dataset, station, period)
+            frames.append(frame)
+            if period == "corrected-archive":
+                archive_checked = now
+
+        frame = merge_observations(frames)
+        if frame is not None:
+            self.store.set(key[0], key[1], key[2], {
+                "updated": station.blob["updated"],
+                "last": last_observation(frame),
+                "uncorrected": first_uncorrected(frame),
+                "archive_checked": archive_checked,
+            }, frame)
+        return (url, status, frame)
+
+
+class ObservationStore(object):
+    """ Observations of each station and parameter, kept between runs.
+
+        Each series is a pickled (state, DataFrame) file in `path`, by
+        default in the statscraper cache directory. Nothing is stored if
+        there is none.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = get_cache_dir("smhi")
+        self.path = path
 
-                    # TODO: This is a very hard coded parse function
-                    # Expects fixed start row and number of cols
-                    for row in raw_data:
-                        #timepoint = datetime.strptime(timepoint_str, "%Y-%m-%d %H:%M:%S")
-                        value_col = parameter.id.split(",")[0]
-                        value = float(row[value_col])
+    def _get_file(self, api, parameter, station):
+        # Pickles are not portable between Python 2 and 3
+        return os.path.join(self.path, "{}-{}-{}-py{}.pickle".format(
+            api, parameter, station, sys.version_info[0]))
+
+    def get(self, api, parameter, station):
+        """ Return (state, DataFrame), or (None, None) if not stored.
+        """
+        if self.path is None:
+            return (None, None)
+        try:
+            with open(self._get_file(api, parameter, station), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # Missing, or corrupt: Will be fetched again
+            return (None, None)
 
-                        row["parameter"] = parameter.id
-                        row["station"] = station.label
-                        row["station_key"] = station.key
-                        row["period"] = period
+    def set(self, api, parameter, station, state, frame):
+        if self.path is None:
+            return
+        data = pickle.dumps((state, frame), pickle.HIGHEST_PROTOCOL)
+        try:
+            write_atomic(self._get_file(api, parameter, station), data)
+        except (IOError, OSError):
+            # A read only cache dir just means fetching everything again
+            pass
 
-                        row.pop(value_col,None)
 
-                        datapoint = Result(value, row)
+def covering_periods(last, now=None):
+    """ Periods that cover all observations since `last` (UTC),
+        shortest first.
+    """
+    if last is None:
+        return []
+    gap = (now or datetime.utcnow()) - last
+    return [period for period, span in LATEST_PERIODS if span >= gap]
 
-                        yield datapoint
 
-                elif r.status_code == 404:
-                    print("Warning no data at {}".format(url))
-                else:
-                    raise Exception("Connection error for {}".format(url))
+def merge_observations(frames):
+    """ Merge frames of observations, in time order. Later frames win
+        where several have a value for the same time.
+    """
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return None
+    frame = pd.concat(frames, ignore_index=True)
+    keys = [c for c in frame.columns
+            if c not in (VALUE_KEY, QUALITY_COLUMN, "period")]
+    frame = frame.drop_duplicates(subset=keys, keep="last")
+    return frame.sort_values(keys).reset_index(drop=True)
+
+
+def observation_times(frame):
+    """ The times of the observations in a frame, as a Series. Times
+        that can not be parsed are NaT.
+    """
+    if u"Tid (UTC)" in frame:
+        times = frame[u"Datum"].astype(str) + " " + frame[u"Tid (UTC)"].astype(str)
+    elif u"Till Datum Tid (UTC)" in frame:
+        times = frame[u"Till Datum Tid (UTC)"]
+    else:
+        times = frame[frame.columns[0]]
+    return pd.to_datetime(times, errors="coerce")
+
+
+def _to_datetime(time):
+    return None if pd.isnull(time) else time.to_pydatetime()
+
+
+def last_observation(frame):
+    """ The time of the last observation in a merged frame, or None.
+    """
+    if not len(frame):
+        return None
+    return _to_datetime(observation_times(frame.iloc[-1:]).iloc[0])
+
+
+def first_uncorrected(frame):
+    """ The time of the first observation that is not from the corrected
+        archive, or None.
+    """
+    frame = frame[frame["period"] != "corrected-archive"]
+    if not len(frame):
+        return None
+    return _to_datetime(observation_times(frame).min())
+
+
+def archive_due(state, now=None):
+    """ Check if the corrected archive should be downloaded again, as it
+        may now cover stored observations that were not corrected.
+    """
+    if state is None or state.get("uncorrected") is None:
+        return False
+    now = now or datetime.utcnow()
+    checked = state.get("archive_checked")
+    return (now - state["uncorrected"] > ARCHIVE_DELAY and
+            (checked is None or now - checked > ARCHIVE_CHECK_INTERVAL))
 
 
 class API(Collection):
@@ -159,21 +443,36 @@ class API(Collection):
         return self._get_json_blob()
 
     def _get_json_blob(self):
-        # Update blob
         error_msg = "Scraper does not support parsing of '{}' yet.".format(self.id)
         try:
-            r = requests.get(self.url)
+            return self.scraper._get_json(self.url)
         except Exception:
-            # Catch ie. "opendata-download-grid.smhi.se"
+            # Catch ie. "opendata-download-grid.smhi.se", and 404s
             raise NotImplementedError(error_msg)
-        if r.status_code == 404:
-            raise NotImplementedError(error_msg)
-
-        return r.json()
 
 
 class StationDimension(Dimension):
 
+    _stations = None  # {key: Station}
+
+    @property
+    def stations(self):
+        """ All stations, by key
+        """
+        if self._stations is None:
+            self._stations = {x.key: x for x in self.allowed_values}
+        return self._stations
+
+    def get_station(self, key_or_label):
+        """ Get a station by key or label
+        """
+        station = self.stations.get(key_or_label)
+        if station is None:
+            station = self.allowed_values.get_by_label(key_or_label)
+        if station is None:
+            raise NoSuchItem(u"No such station: {}".format(key_or_label))
+        return station
+
     def active_stations(self):
         """ Get a list of all active stations
         """
@@ -213,10 +512,7 @@ class SMHIDataset(Dataset):
 
     @property
     def json(self):
-        if not hasattr(self, "_json"):
-            print(self.url)
-            self._json = requests.get(self.url).json()
-        return self._json
+        return self.scraper._get_json(self.url)
 
 
     def get_stations_list(self):
@@ -234,82 +530,196 @@ class SMHIDataset(Dataset):
         stations = self.dimensions["station"].active_stations()
         return self._format_station_list(stations)
 
-    def _get_example_csv(self):
-        """For dimension parsing
+    def _get_columns(self):
+        """For dimension parsing: The columns of the data files of this
+           parameter, cached by parameter.
+
+           Only the start of an example file is downloaded.
         """
+        with _columns_lock:
+            lock = _columns_locks.setdefault(self.url, Lock())
+        # Other parameters are not held up by the download
+        with lock:
+            if self.url not in _columns:
+                _columns[self.url] = self._fetch_columns()
+        return _columns[self.url]
+
+    def _fetch_columns(self):
         station_key = self.json["station"][0]["key"]
         period = "corrected-archive"
         url = self.url\
                   .replace(".json", "/station/{}/period/{}/data.csv"\
                   .format(station_key, period))
 
-        r = requests.get(url)
-        if r.status_code == 200:
-            return DataCsv().from_string(r.content)
-        else:
-            raise Exception("Error connecting to api")
+        r = self.scraper.session.get(url, stream=True)
+        try:
+            if r.status_code == 200:
+                return read_columns(r.iter_content(CHUNK_SIZE))
+            else:
+                raise Exception("Error connecting to api")
+        finally:
+            r.close()
 
 
     def _format_station_list(self, stations):
         data = []
         for station in stations:
-            json_data = station.blob
-            # Inlude all props but link
+            # Inlude all props but link, without touching the cached blob
+            json_data = dict(station.blob)
             json_data.pop('link', None)
-            data.append(station.blob)
+            data.append(json_data)
 
         return data
 
 
 class DataCsv(object):
+    """ A csv file from the SMHI API.
+
+        The files start with a few small tables of metadata (station,
+        parameter, period), separated by empty rows. The last table
+        holds the data. Only the metadata is parsed row by row, the data
+        table is handed to pandas, in one go.
+    """
     columns = []
-    data = []
+    tables = []  # The metadata tables, as lists of rows
+    frame = None  # The data table
 
     def from_file(self, file_path):
-        with open(file_path) as f:
-            self._parse(f)
+        with open(file_path, "rb") as f:
+            self._parse(f.read())
 
         return self
 
     def from_string(self, csv_content):
-        f = StringIO.StringIO(csv_content)
-        self._parse(f)
+        self._parse(csv_content)
 
         return self
 
+    @property
+    def data(self):
+        """ The data table, as a list of rows
+        """
+        return self.frame.values.tolist()
+
     def to_dictlist(self):
-        return [dict(zip(self.columns, row))
-            for row in self.data]
-
-    def _parse(self, f):
-        rows = list(csv.reader(f, delimiter=';'))
-        tables = []
-        table = []
-        for i, row in enumerate(rows):
-            is_last = i == len(rows) - 1
-
-            # Check if new table
-            if is_empty(row):
-                if len(table) > 0:
-                    tables.append(table)
-                table = []
-                continue
+        return self.frame.to_dict("records")
+
+    def _parse(self, content):
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        content = content.rstrip()
+
+        offset = find_data_header(content)
+        end = content.find(b"\n", offset)
+        if end == -1:
+            end = len(content)
+
+        header = split_row(content[offset:end])
+        self.columns = header[:table_width(header)]
+        self.tables = parse_tables(content[:offset])
+
+        body = content[end + 1:] if end < len(content) else b""
+        # Drop trailing rows with an empty first column: Notes in the
+        # extra columns, when there are more notes than data rows
+        if body.startswith(b";"):
+            body = b""
+        elif b"\n;" in body:
+            body = body[:body.index(b"\n;")]
+        if body.strip():
+            self.frame = pd.read_csv(BytesIO(body), sep=";", header=None,
+                                     names=self.columns,
+                                     usecols=range(len(self.columns)),
+                                     encoding="utf-8")
+        else:
+            self.frame = pd.DataFrame(columns=self.columns)
+
 
-            is_header = len(table) == 0
-            if is_header:
-                n_cols = table_width(row)
+def find_data_header(content):
+    """ Find the offset of the header of the data table in an SMHI csv
+        file: The first row with a quality column, or else the first
+        row of the last table.
+    """
+    start = 0
+    while True:
+        i = content.find(QUALITY_COLUMN.encode("utf-8"), start)
+        if i == -1:
+            break
+        line_start = content.rfind(b"\n", 0, i) + 1
+        line_end = content.find(b"\n", i)
+        if line_end == -1:
+            line_end = len(content)
+        if QUALITY_COLUMN in split_row(content[line_start:line_end]):
+            return line_start
+        start = line_end
+
+    # Skip trailing rows with an empty first column (see is_empty),
+    # then find the empty row before the last table
+    end = len(content)
+    while True:
+        line_start = content.rfind(b"\n", 0, end) + 1
+        if line_start == 0 or content[line_start:end].strip(b"\r") and \
+                not content.startswith(b";", line_start):
+            break
+        end = line_start - 1
+    offset = max(content.rfind(b"\n\n", 0, end),
+                 content.rfind(b"\n\r\n", 0, end),
+                 content.rfind(b"\n;", 0, end)) + 1
+    if offset:
+        offset = content.find(b"\n", offset) + 1
+    return offset
 
-            table.append(row[:n_cols])
 
-            if is_last:
+def read_columns(chunks):
+    """ Read the columns of the data table of an SMHI csv file, from
+        chunks of bytes, without reading the data itself.
+
+        The data table is the first table with a quality column, or the
+        last table, if none has one.
+    """
+    lines = []
+    rest = b""
+    for chunk in chunks:
+        parts = (rest + chunk).split(b"\n")
+        rest = parts.pop()
+        for line in parts:
+            row = split_row(line)
+            if QUALITY_COLUMN in row:
+                return row[:table_width(row)]
+            lines.append(line)
+    lines.append(rest)
+    return DataCsv().from_string(b"\n".join(lines)).columns
+
+
+def split_row(line):
+    """ Split a line of an SMHI csv file. Metadata has no quoted values.
+    """
+    return line.decode("utf-8").rstrip(u"\r").split(u";")
+
+
+def parse_tables(content):
+    """ Split the rows of a csv file into tables, at empty rows.
+        Each table is cut to the width of its header.
+    """
+    tables = []
+    table = []
+    for row in (split_row(line) for line in content.split(b"\n")):
+        # Check if new table
+        if is_empty(row):
+            if len(table) > 0:
                 tables.append(table)
+            table = []
+            continue
+
+        is_header = len(table) == 0
+        if is_header:
+            n_cols = table_width(row)
+
+        table.append(row[:n_cols])
+
+    if len(table) > 0:
+        tables.append(table)
+    return tables
 
-        data_table = tables[-1]
-        self.columns = data_table[0]
-        try:
-            self.data = data_table[1:]
-        except IndexError:
-            self.data = []
 
 def is_empty(row):
     """ Check if a csv row (represented as a list
@@ -332,5 +742,5 @@ def table_width(row):
 
     for i, val in enumerate(row):
         if val == "":
-            break
-    return i
+            return i
+    return len(row)
@@ -1,5 +1,4 @@
 # encoding: utf-8
-import requests
 from bs4 import BeautifulSoup
 import requests_cache
 from requests.exceptions import RequestException
@@ -142,7 +141,7 @@ class VantetiderScraper(BaseScraper):
         """ Get html from url
         """
         self.log.info(u"/GET {}".format(url))
-        r = requests.get(url)
+        r = self.session.get(url)
         if hasattr(r, 'from_cache'):
             if r.from_cache:
                 self.log.info("(from cache)")
@@ -154,7 +153,7 @@ class VantetiderScraper(BaseScraper):
 
     def _post_html(self, url, payload):
         self.log.info(u"/POST {} with {}".format(url, payload))
-        r = requests.post(url, payload)
+        r = self.session.post(url, payload)
         if r.status_code != 200:
             throw_request_err(r)
 
@@ -164,7 +163,7 @@ class VantetiderScraper(BaseScraper):
         """ Get json from url
         """
         self.log.info(u"/GET " + url)
-        r = requests.get(url)
+        r = self.session.get(url)
         if hasattr(r, 'from_cache'):
             if r.from_cache:
                 self.log.info("(from cache)")
@@ -1,8 +1,8 @@
 # encoding: utf-8
 
 import pandas as pd
-import json
-from statscraper import BaseScraper, Dataset, Dimension, Result
+from io import BytesIO
+from statscraper import BaseScraper, Dataset, Dimension
 
 MONTHS = ['januari', 'februari', 'mars', 'april', 'maj', 'juni'
           'juli', 'augusti', 'september', 'oktober', 'november', 'december']
@@ -58,11 +58,11 @@ class Vehicles(BaseScraper):
         for file in files:
             year, month = file
             url = self.BASE_URL.format(year=year, month=MONTHS[month])
-            frame = self._clean_data(pd.read_excel(url), year, month)
+            r = self.session.get(url)
+            r.raise_for_status()
+            frame = self._clean_data(pd.read_excel(BytesIO(r.content)),
+                                     year, month)
             frames.append(frame)
 
-        # Yield individual rows of type Result from the dataframe
-        raw_data = pd.concat(frames)
-        for i, row in raw_data.iterrows():
-            val = row.pop('value')
-            yield Result(val, json.loads(row.to_json()))
+        # Yield all rows at once, with the values in the 'value' column
+        yield pd.concat(frames)
@@ -4,7 +4,6 @@ u""" A scraper to fetch Swedish university application statistics from
  at http://statistik.uka.se
 """
 from statscraper import BaseScraper, Dataset, Dimension, Result, Collection
-import requests
 from bs4 import BeautifulSoup
 
 
@@ -51,12 +50,12 @@ class UKA(BaseScraper):
             # Get all municipalities, and their codes, from this year
             year = ((t - 5) / 2) + 1993
             semester = ["HT", "VT"][t % 2]
-            municipalities = requests.get(thenmap_url % year).json()
+            municipalities = self.session.get(thenmap_url % year).json()
             for id_, municipality_ in municipalities["data"].items():
                 municipality = municipality_.pop()
                 code = municipality["kommunkod"].zfill(4)
                 c, m = code[:2], code[2:]
-                html = requests.get(url % (t, c, m)).text
+                html = self.session.get(url % (t, c, m)).text
                 soup = BeautifulSoup(html, 'html.parser')
                 table = soup.find("table")
                 # The first rows are headers, the last are empty
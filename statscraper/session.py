@@ -0,0 +1,123 @@
+# encoding: utf-8
+""" A pooled HTTP session for scrapers.
+
+Each scraper gets a requests Session from `create_session()`, through
+`BaseScraper.session`. Connections are kept alive and reused, at most
+`pool_maxsize` per host. Requests that fail with a connection error,
+or with one of RETRY_STATUSES, are retried with an exponential backoff,
+honouring any Retry-After header. Responses are gzip compressed, if
+the server supports it.
+
+The Session class is looked up when the session is created, so that
+`requests_cache.install_cache()` still applies.
+
+APIs that limit the rate of requests per host can be respected with a
+shared RateLimiter from `get_rate_limiter()`.
+"""
+import time
+from collections import deque
+from threading import Lock
+from six.moves.urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = 60  # seconds, for connecting and between bytes read
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_rate_limiters = {}  # {host: RateLimiter}
+_rate_limiters_lock = Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter with a default timeout."""
+
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeout"]  # Pickled attributes
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, *args, **kwargs):
+        self.timeout = timeout
+        super(TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super(TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+def create_retry(retries=3, backoff_factor=0.5):
+    """Return a urllib3 Retry, for all request methods.
+
+    PX-Web queries are POST requests, but safe to repeat.
+    """
+    kwargs = {
+        "total": retries,
+        "backoff_factor": backoff_factor,
+        "status_forcelist": RETRY_STATUSES,
+        "raise_on_status": False,
+    }
+    try:
+        return Retry(allowed_methods=None, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=False, **kwargs)
+
+
+def create_session(timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=0.5,
+                   pool_connections=10, pool_maxsize=10, headers=None):
+    """Return a requests Session with pooled connections and retries.
+
+    `pool_connections` is the number of hosts to keep connections to,
+    and `pool_maxsize` the number of connections to keep per host.
+    """
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout=timeout,
+                                 max_retries=create_retry(retries,
+                                                          backoff_factor),
+                                 pool_connections=pool_connections,
+                                 pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class RateLimiter(object):
+    """Allow at most `max_calls` calls in any `period` seconds.
+
+    Thread safe: wait() blocks until a call is allowed.
+    """
+
+    def __init__(self, max_calls, period, timer=time.time, sleep=time.sleep):
+        self.max_calls = max_calls
+        self.period = period
+        self._timer = timer
+        self._sleep = sleep
+        self._lock = Lock()
+        self._calls = deque()  # Times of the latest calls
+
+    def wait(self):
+        """Block until another call is allowed, and count it."""
+        with self._lock:
+            while True:
+                now = self._timer()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                self._sleep(self._calls[0] + self.period - now)
+
+
+def get_rate_limiter(url, max_calls, period):
+    """Return the RateLimiter for the host of a url.
+
+    All callers share one limiter per host, with the limits given
+    by the first caller.
+    """
+    host = urlparse(url).netloc
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = RateLimiter(max_calls, period)
+        return _rate_limiters[host]
@@ -1,7 +1,11 @@
 # encoding:utf-8
+from datetime import date
 from unittest import TestCase
+from six.moves import cPickle as pickle
 from statscraper import (BaseScraper, Dataset, Dimension, Result,
-                         DimensionValue, Collection, ROOT, NoSuchItem)
+                         DimensionValue, Collection, ROOT, NoSuchItem,
+                         canonical_query)
+from statscraper.session import RateLimiter
 
 
 class Scraper(BaseScraper):
@@ -66,6 +70,18 @@ class NestedScraper(Scraper):
             raise Exception("This can not possibly happen.")
 
 
+class StatelessScraper(NestedScraper):
+    """A nested scraper that does not need the cursor."""
+
+    stateless = True
+
+    def _fetch_itemslist(self, item):
+        if self.current_item is not self.root:
+            raise Exception("The cursor should not move.")
+        for i in super(StatelessScraper, self)._fetch_itemslist(item):
+            yield i
+
+
 class CallbackScraper(Scraper):
     """A scraper with callbacks
     """
@@ -243,3 +259,235 @@ class TestBaseScraper(TestCase):
         """Extending the basescraper."""
         scraper = CallbackScraper()
         self.assertTrue(scraper.initiated)
+
+
+class KwargsScraper(Scraper):
+    """Counts calls to _fetch_data."""
+
+    uncached_kwargs = ("refresh",)
+    calls = 0
+
+    def _fetch_data(self, dataset, query=None, scale=1, refresh=False,
+                    progress=None):
+        self.calls += 1
+        yield Result(scale, {})
+
+
+class TestCanonicalQuery(TestCase):
+
+    def test_equivalent_queries(self):
+        """Order, list wrapping and value objects do not matter."""
+        region = Dimension("region")
+        self.assertEqual(canonical_query({"region": ["01", "03"]}),
+                         canonical_query({"region": ("03", "01", "03")}))
+        self.assertEqual(canonical_query({"region": "01"}),
+                         canonical_query({u"region": [b"01"]}))
+        self.assertEqual(
+            canonical_query({"region": [DimensionValue("01", region)]}),
+            {"region": ["01"]})
+        self.assertEqual(canonical_query({"a": {"b": [2, 1]}}),
+                         {"a": {"b": [1, 2]}})
+        self.assertEqual(canonical_query(None), None)
+
+    def test_hash(self):
+        dataset = Scraper().items["Dataset_1"]
+        dataset.query = {"municipality": ["Umeå kommun", "Robertsfors kommun"]}
+        hash_ = dataset._hash
+        dataset.query = {"municipality": ["Robertsfors kommun", "Umeå kommun"]}
+        self.assertEqual(dataset._hash, hash_)
+        dataset.query = {"municipality": "Umeå kommun"}
+        self.assertNotEqual(dataset._hash, hash_)
+
+    def test_values_without_json(self):
+        """Values that JSON can not serialize are hashed by their repr."""
+        dates = [date(2017, 1, 1), date(2016, 1, 1)]
+        self.assertEqual(canonical_query({"month": dates}),
+                         {"month": sorted(dates, key=repr)})
+        dataset = Scraper().items["Dataset_1"]
+        dataset.query = {"month": dates}
+        hash_ = dataset._hash
+        dataset.query = {"month": dates[::-1]}
+        self.assertEqual(dataset._hash, hash_)
+
+    def test_cached_kwargs(self):
+        """Keyword arguments are part of the cache key."""
+        scraper = KwargsScraper()
+        dataset = scraper.items[0]
+        self.assertEqual(dataset.fetch(scale=2)[0].value, 2)
+        self.assertEqual(dataset.fetch(scale=3)[0].value, 3)
+        self.assertEqual(dataset.fetch(scale=2, progress=len)[0].value, 2)
+        self.assertEqual(scraper.calls, 2)
+
+        # Uncached kwargs ask the scraper every time
+        dataset.fetch(scale=2, refresh=True)
+        list(dataset.fetch_next(scale=2, refresh=True))
+        self.assertEqual(scraper.calls, 4)
+        dataset.fetch(scale=2, refresh=False)
+        self.assertEqual(scraper.calls, 5)
+
+
+class TestSession(TestCase):
+
+    def test_pooled_session(self):
+        """A scraper keeps one configured session."""
+        scraper = Scraper()
+        scraper.http_timeout = 5
+        session = scraper.session
+        self.assertTrue(scraper.session is session)
+        adapter = session.get_adapter("https://example.com")
+        self.assertEqual(adapter.timeout, 5)
+        self.assertEqual(adapter.max_retries.total, Scraper.http_retries)
+        self.assertTrue(429 in adapter.max_retries.status_forcelist)
+        self.assertFalse(Scraper().session is session)
+
+    def test_pickle_session(self):
+        scraper = Scraper()
+        scraper.http_timeout = 5
+        session = pickle.loads(pickle.dumps(scraper.session))
+        self.assertEqual(session.get_adapter("https://example.com").timeout,
+                         5)
+
+    def test_rate_limiter(self):
+        """At most max_calls calls are made per period."""
+        clock = []
+
+        def sleep(seconds):
+            clock.append(clock[-1] + seconds)
+
+        limiter = RateLimiter(3, 10, timer=lambda: clock[-1], sleep=sleep)
+        clock.append(0)
+        for i in range(7):
+            limiter.wait()
+        self.assertEqual(clock[-1], 20)
+
+
+class TestCrawl(TestCase):
+
+    def _check(self, scraper):
+        items = scraper.crawl()
+        self.assertEqual([i.id for i in items],
+                         ["Collection_1", "Collection_2",
+                          "Dataset_1", "Dataset_2", "Dataset_3"])
+        self.assertEqual([i.id for i in items[4].path],
+                         ["Collection_2", "Dataset_3"])
+        self.assertTrue(scraper.current_item is scraper.root)
+        self.assertEqual([i.id for i in scraper.descendants],
+                         ["Dataset_1", "Dataset_2", "Dataset_3"])
+
+    def test_crawl(self):
+        self._check(NestedScraper())
+
+    def test_crawl_stateless(self):
+        """Stateless scrapers are crawled without moving the cursor."""
+        self._check(StatelessScraper())
+
+    def test_crawl_from_collection(self):
+        scraper = NestedScraper().move_to("Collection_2")
+        self.assertEqual([i.id for i in scraper.crawl()],
+                         ["Dataset_2", "Dataset_3"])
+        self.assertEqual(scraper.current_item.id, "Collection_2")
+
+
+class CountingScraper(StatelessScraper):
+    """A stateless scraper counting item list fetches."""
+
+    def _fetch_itemslist(self, item):
+        self.fetched = getattr(self, "fetched", 0) + 1
+        for i in super(CountingScraper, self)._fetch_itemslist(item):
+            yield i
+
+
+class RacingDataset(Dataset):
+    """Waits for another thread, right after its query is first set."""
+
+    _query = None
+    hold = True
+
+    @property
+    def query(self):
+        return self._query
+
+    @query.setter
+    def query(self, query):
+        self._query = query
+        if self.hold:
+            self.hold = False
+            self.held.set()
+            self.go.wait(5)
+
+
+class QueryScraper(StatelessScraper):
+    """Returns the query it is given."""
+
+    def _fetch_itemslist(self, item):
+        yield RacingDataset("Dataset_1")
+
+    def _fetch_data(self, dataset, query=None):
+        yield Result(query["n"], {})
+
+
+class TestStateless(TestCase):
+
+    def test_no_cursor_moves(self):
+        """Items of stateless scrapers are used where they are."""
+        scraper = StatelessScraper()
+        moves = []
+        scraper._hooks["select"].append(lambda s, id_: moves.append(id_))
+        try:
+            dataset = scraper["Collection_2"]["Dataset_2"]
+            self.assertEqual(len(dataset.dimensions), 3)
+            self.assertEqual([r.value for r in dataset.fetch()], [12, 130])
+            self.assertEqual(scraper["Collection_1"]["Dataset_1"]
+                             .fetch()[0].value, 127)
+        finally:
+            scraper._hooks["select"].pop()
+        self.assertTrue(scraper.current_item is scraper.root)
+        self.assertEqual(moves, [])
+
+    def test_pickle(self):
+        """Items, and results through their dataset, can be pickled."""
+        data = StatelessScraper()["Collection_2"]["Dataset_2"].fetch()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(data, protocol))
+            self.assertEqual([r.value for r in copied], [12, 130])
+            dataset = copied[0].dataset
+            self.assertFalse(dataset._lock is data.dataset._lock)
+            self.assertEqual(len(dataset.dimensions), 3)
+            self.assertEqual(dataset.fetch()[1].value, 130)
+
+    def test_concurrent_fetch(self):
+        from multiprocessing.pool import ThreadPool
+        scraper = CountingScraper()
+        collection = scraper["Collection_2"]
+        scraper.fetched = 0
+
+        def fetch(i):
+            dataset = collection.items[i % 2]
+            return [r.value for r in dataset.fetch()]
+
+        pool = ThreadPool(4)
+        try:
+            values = pool.map(fetch, range(8))
+        finally:
+            pool.terminate()
+        self.assertEqual(values, [[12, 130], []] * 4)
+        # The items of the collection were only fetched once
+        self.assertEqual(scraper.fetched, 1)
+
+    def test_concurrent_queries(self):
+        """Each fetch uses its own query, whatever other threads do."""
+        from threading import Event, Thread
+        dataset = QueryScraper().items[0]
+        dataset.held, dataset.go = Event(), Event()
+        values = []
+
+        thread = Thread(target=lambda: values.append(
+            dataset.fetch({"n": 1})[0].value))
+        thread.start()
+        self.assertTrue(dataset.held.wait(5))
+        # The first thread has set its query, but not yet used it
+        self.assertEqual(dataset.fetch({"n": 2})[0].value, 2)
+        dataset.go.set()
+        thread.join()
+        self.assertEqual(values, [1])
+        self.assertEqual(dataset.fetch({"n": 1})[0].value, 1)
@@ -0,0 +1,222 @@
+# encoding: utf-8
+import os
+from six.moves import cPickle as pickle
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from statscraper.cache import (ResultCache, PersistentResultCache,
+                               DocumentCache, CACHE_DIR_ENVVAR,
+                               get_cache_dir)
+from .test_resultset import Scraper, ColumnarScraper
+
+
+class Clock(object):
+    """A timer that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(TestCase):
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted first."""
+        cache = ResultCache(max_entries=2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.stats["hits"], 1)
+        self.assertEqual(cache.stats["misses"], 1)
+        self.assertEqual(cache.stats["evictions"], 1)
+
+    def test_max_bytes(self):
+        cache = ResultCache(max_bytes=1000)
+        cache["a"] = b"x" * 600
+        cache["b"] = b"x" * 600
+        self.assertFalse("a" in cache)
+        self.assertTrue(cache.nbytes <= 1000)
+        cache["c"] = b"x" * 2000
+        self.assertFalse("c" in cache)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = ResultCache(ttl=10, timer=clock)
+        cache["a"] = 1
+        clock.now = 9
+        self.assertEqual(cache["a"], 1)
+        clock.now = 10
+        with self.assertRaises(KeyError):
+            cache["a"]
+        self.assertEqual(len(cache), 0)
+
+    def test_scraper_cache(self):
+        """Query results are kept in the scraper's cache."""
+        scraper = Scraper()
+        scraper.cache = ResultCache(max_entries=1)
+        dataset = scraper.items[0]
+        data = dataset.fetch({"year": "2017"})
+        self.assertTrue(dataset.fetch({"year": "2017"}) is data)
+        dataset.fetch({"year": "2016"})
+        self.assertFalse(dataset.fetch({"year": "2017"}) is data)
+        self.assertEqual(scraper.cache.evictions, 2)
+        self.assertTrue(scraper.cache.nbytes > 0)
+
+    def test_pickle(self):
+        cache = ResultCache(max_entries=2)
+        cache["a"] = 1
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(cache["a"], 1)
+        cache["b"] = 2
+        cache["c"] = 3
+        self.assertFalse("a" in cache)
+
+
+class TestPersistentResultCache(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = os.path.join(self.dir, "results.sqlite")
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_ttl(self):
+        clock = Clock()
+        cache = PersistentResultCache(self.path, ttl=10, timer=clock)
+        cache["a"] = [1, 2]
+        other_process = PersistentResultCache(self.path, timer=clock)
+        self.assertEqual(other_process.get("a"), [1, 2])
+        clock.now = 10
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats["misses"], 1)
+
+    def test_max_bytes(self):
+        clock = Clock()
+        cache = PersistentResultCache(self.path, max_bytes=100, timer=clock)
+        cache["a"] = os.urandom(60)
+        clock.now = 1
+        cache["b"] = os.urandom(60)
+        self.assertFalse("a" in cache)
+        self.assertTrue("b" in cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_shared_results(self):
+        """A new scraper reuses results from the persistent cache."""
+        for scraper_class in (Scraper, ColumnarScraper):
+            cache = PersistentResultCache(self.path)
+            scraper = scraper_class()
+            scraper.persistent_cache = cache
+            data = scraper.items[0].data
+
+            scraper = scraper_class()
+            scraper.persistent_cache = cache
+            scraper._fetch_data = None  # Must not be called
+            cached = scraper.items[0].data
+            self.assertTrue(isinstance(cached, scraper_class.resultset_class))
+            self.assertEqual(cached.list_of_dicts, data.list_of_dicts)
+            self.assertEqual(cached[0]["municipality"].dimension.datatype.id,
+                             "region")
+            self.assertEqual(cache.hits, 1)
+
+
+class Response(object):
+
+    def __init__(self, status_code, data=None, headers={}):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers
+
+    def json(self):
+        return self.data
+
+
+class Session(object):
+    """Serves a document with an ETag, and records requests."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers={}):
+        self.requests.append(headers)
+        if headers.get("If-None-Match") == "v1":
+            return Response(304)
+        return Response(200, {"url": url}, {"ETag": "v1"})
+
+
+class TestDocumentCache(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self._env = os.environ.get(CACHE_DIR_ENVVAR)
+        os.environ[CACHE_DIR_ENVVAR] = self.dir
+
+    def tearDown(self):
+        if self._env is None:
+            del os.environ[CACHE_DIR_ENVVAR]
+        else:
+            os.environ[CACHE_DIR_ENVVAR] = self._env
+        rmtree(self.dir)
+
+    def test_revalidation(self):
+        clock = Clock()
+        session = Session()
+        url = "http://api.example.com/db"
+        documents = DocumentCache(max_age=10, timer=clock)
+        self.assertEqual(documents.get_json(session, url), {"url": url})
+        self.assertEqual(documents.get_json(session, url), {"url": url})
+        self.assertEqual(len(session.requests), 1)
+
+        clock.now = 10
+        self.assertEqual(documents.get_json(session, url), {"url": url})
+        self.assertEqual(session.requests[-1], {"If-None-Match": "v1"})
+        self.assertEqual((documents.hits, documents.revalidations,
+                          documents.downloads), (1, 1, 1))
+
+    def test_persisted(self):
+        """Documents are reused by new caches."""
+        session = Session()
+        url = "http://api.example.com/db"
+        DocumentCache().get_json(session, url)
+        self.assertEqual(DocumentCache().get_json(session, url),
+                         {"url": url})
+        self.assertEqual(len(session.requests), 1)
+        DocumentCache(persist=False).get_json(session, url)
+        self.assertEqual(len(session.requests), 2)
+
+    def test_pickle(self):
+        session = Session()
+        url = "http://api.example.com/db"
+        documents = DocumentCache(persist=False)
+        documents.get_json(session, url)
+        documents = pickle.loads(pickle.dumps(documents))
+        self.assertEqual(documents.get_json(session, url), {"url": url})
+        self.assertEqual(len(session.requests), 1)
+
+
+class TestCacheDir(TestCase):
+
+    def test_opt_in(self):
+        """Nothing is cached on disk unless a directory is given."""
+        env = os.environ.pop(CACHE_DIR_ENVVAR, None)
+        path = mkdtemp()
+        try:
+            self.assertEqual(get_cache_dir("documents"), None)
+            self.assertEqual(DocumentCache().path, None)
+            os.environ[CACHE_DIR_ENVVAR] = path
+            self.assertEqual(get_cache_dir("documents"),
+                             os.path.join(path, "documents"))
+            self.assertTrue(os.path.isdir(os.path.join(path, "documents")))
+        finally:
+            os.environ.pop(CACHE_DIR_ENVVAR, None)
+            if env is not None:
+                os.environ[CACHE_DIR_ENVVAR] = env
+            rmtree(path)
@@ -1,7 +1,13 @@
 # encoding: utf-8
 
+import os
+from copy import copy, deepcopy
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
-from statscraper import Datatype, NoSuchDatatype
+from statscraper import Datatype, Dimension, DimensionValue, NoSuchDatatype
+from statscraper import datatypes
+from statscraper.cache import CACHE_DIR_ENVVAR
 
 
 class TestDatatype(TestCase):
@@ -33,3 +39,52 @@ class TestDatatype(TestCase):
 
         self.assertTrue("scb" in val.dialects)
         self.assertEqual(u"0780 Växjö kommun", val.dialects["scb"].pop())
+
+    def test_shared_allowed_values(self):
+        """Allowed values are parsed once, and shared read only."""
+        values = Datatype("region").allowed_values
+        self.assertTrue(Datatype("region").allowed_values is values)
+        with self.assertRaises(TypeError):
+            values.append(values[0])
+
+    def test_copy_allowed_values(self):
+        """Copies of shared allowed values are writable."""
+        values = Datatype("region").allowed_values
+        for copied in (copy(values), deepcopy(values)):
+            copied.append(DimensionValue(u"Atlantis", Dimension("region")))
+            self.assertTrue(u"Atlantis" in copied)
+            self.assertTrue(u"Växjö kommun" in copied)
+        self.assertFalse(u"Atlantis" in values)
+
+    def test_dialects_from_all_files(self):
+        """A datatype has the dialects of all its value files."""
+        dt = Datatype("region")
+        self.assertTrue("scb" in dt.dialects)
+        self.assertTrue("arbetsmiljoverket" in dt.dialects)
+
+    def test_compiled_cache(self):
+        """Parsed csv files are reused from the compiled cache."""
+        cache_dir = mkdtemp()
+        old_cache_dir = os.environ.get(CACHE_DIR_ENVVAR)
+        os.environ[CACHE_DIR_ENVVAR] = cache_dir
+        datatypes._compiled = None
+        try:
+            rows = datatypes._read_compiled(datatypes.DATATYPES_FILE,
+                                            datatypes._parse_datatypes_file)
+            datatypes._save_compiled()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # A new process reads the compiled file instead of the csv
+            def parse(path):
+                raise AssertionError("%s was parsed again" % path)
+            datatypes._compiled = None
+            self.assertEqual(datatypes._read_compiled(datatypes.DATATYPES_FILE,
+                                                      parse),
+                             rows)
+        finally:
+            datatypes._compiled = None
+            if old_cache_dir is None:
+                del os.environ[CACHE_DIR_ENVVAR]
+            else:
+                os.environ[CACHE_DIR_ENVVAR] = old_cache_dir
+            rmtree(cache_dir)
@@ -19,6 +19,24 @@ class Scraper(BaseScraper):
         })
 
 
+class DialectScraper(BaseScraper):
+    """A scraper with values in a foreign dialect."""
+
+    def _fetch_itemslist(self, item):
+        yield Dataset("Dataset_1")
+
+    def _fetch_dimensions(self, dataset):
+        yield Dimension(u"month", datatype="month", dialect="swedish")
+
+    def _fetch_data(self, dataset, query=None):
+        yield Result(127, {
+            "month": "mars",
+        })
+        yield Result(12, {
+            "month": "Marsch",
+        })
+
+
 class TestDialects(TestCase):
 
     def test_dialects(self):
@@ -31,3 +49,10 @@ class TestDialects(TestCase):
         data2 = data1.translate("scb")
         self.assertEqual(str(data2[0]["municipality"]), "2409 Robertsfors kommun")
 
+    def test_normalize_dialect(self):
+        """Values in a foreign dialect are normalized on fetch."""
+        scraper = DialectScraper()
+        data = scraper.items[0].data
+        self.assertEqual(str(data[0]["month"]), "march")
+        # Unknown values are left as they are
+        self.assertEqual(str(data[1]["month"]), "Marsch")
@@ -1,8 +1,18 @@
 # encoding: utf-8
 
+from threading import Event, Thread
 from unittest import TestCase
+from six.moves.queue import Queue
 
+from collections import OrderedDict
+from json import dumps
+
+from statscraper import Dataset, Dimension, Result
+from statscraper.compat import JSONDecodeError
 from statscraper.scrapers import PXWeb
+from statscraper.scrapers import PXWebScraper
+from statscraper.scrapers.PXWebScraper import (iter_json_stream,
+                                               decode_json_stat, decode_rows)
 
 
 class TestPXWeb(TestCase):
@@ -21,3 +31,259 @@ class TestPXWeb(TestCase):
         data = scraper.fetch()
         self.assertTrue(len(data))
 
+
+class TestQuerySplitting(TestCase):
+
+    def setUp(self):
+        self.scraper = PXWeb()
+        self.scraper.base_url = "http://api.example.com/v1/sv/db"
+        self.scraper.max_values = 100
+
+    def test_small_query(self):
+        query = {"Region": ["01", "03"], "Tid": "2017"}
+        self.assertEqual(self.scraper._split_query(query),
+                         [{"Region": ["01", "03"], "Tid": ["2017"]}])
+
+    def test_split_largest_dimension(self):
+        regions = [str(x) for x in range(290)]
+        years = [str(x) for x in range(2000, 2010)]
+        query = {"Region": regions, "Tid": years, "Kon": ["1", "2"]}
+        queries = self.scraper._split_query(query)
+        self.assertEqual(len(queries), 58)
+        for subquery in queries:
+            self.assertEqual(subquery["Tid"], years)
+            self.assertEqual(subquery["Kon"], ["1", "2"])
+            self.assertEqual(len(subquery["Region"]), 5)
+        self.assertEqual(sum((q["Region"] for q in queries), []), regions)
+
+    def test_split_several_dimensions(self):
+        query = {"Region": [str(x) for x in range(300)],
+                 "Tid": [str(x) for x in range(200)]}
+        queries = self.scraper._split_query(query)
+        self.assertEqual(len(queries), 300 * 2)
+        self.assertEqual(queries[0], {"Region": ["0"],
+                                      "Tid": [str(x) for x in range(100)]})
+
+    def test_dimensions_left_out(self):
+        """Dimensions that are not in the query count towards the cells."""
+        self.scraper.max_values = 4
+        dimensions = [Dimension("Region", allowed_values=["01", "03"]),
+                      Dimension("ContentsCode",
+                                allowed_values=["BE0101N1", "BE0101N2"]),
+                      Dimension("Tid", allowed_values=["2016", "2017"])]
+        query = {"Region": ["01", "03"], "Tid": ["2016", "2017"]}
+        queries = self.scraper._split_query(query, dimensions=dimensions)
+        self.assertEqual(len(queries), 2)
+        for subquery in queries:
+            self.assertEqual(len(subquery["Region"]) * len(subquery["Tid"]),
+                             2)
+
+    def test_other_filters(self):
+        query = {"Region": ["*"]}
+        self.assertEqual(self.scraper._split_query(query, filtertype="all"),
+                         [{"Region": ["*"]}])
+
+
+class SplitPXWeb(PXWeb):
+    """Answers split queries without asking an API."""
+
+    base_url = "http://api.example.com/v1/sv/db"
+    max_values = 2
+
+    def __init__(self, *args, **kwargs):
+        super(SplitPXWeb, self).__init__(*args, **kwargs)
+        self.release = Event()  # Holds the first query back until set
+        self.finished = Queue()  # Gets the other queries, as they finish
+
+    def _fetch_query(self, dataset, query, filtertype):
+        first = "01" in query["Region"]
+        if first:
+            self.release.wait(5)
+        for region in query["Region"]:
+            yield Result(1, {"Region": region})
+        if not first:
+            self.finished.put(query)
+
+
+class TestParallelQueries(TestCase):
+
+    def test_ordered(self):
+        """Results from parallel queries are yielded in order."""
+        regions = ["01", "03", "04", "05", "06"]
+        scraper = SplitPXWeb()
+
+        def release():
+            # Let the first query finish last
+            for _ in range(2):
+                scraper.finished.get(timeout=5)
+            scraper.release.set()
+        Thread(target=release).start()
+
+        results = scraper._fetch_data(None, {"Region": regions})
+        self.assertEqual([r.raw_dimensions["Region"] for r in results],
+                         regions)
+
+    def test_unordered(self):
+        regions = ["01", "03", "04", "05", "06"]
+        scraper = SplitPXWeb()
+        results = scraper._fetch_data(None, {"Region": regions},
+                                      ordered=False)
+        first = next(results)
+        scraper.release.set()
+        regions_found = [r.raw_dimensions["Region"]
+                         for r in [first] + list(results)]
+        self.assertEqual(sorted(regions_found), regions)
+        self.assertNotEqual(regions_found[0], "01")
+
+
+class TestJSONStream(TestCase):
+
+    RESPONSE = u"""\ufeff{"columns": [{"code": "Region", "type": "d"}],
+        "comments": [],
+        "data": [{"key": ["Umeå"], "values": ["12345"]},
+                 {"key": ["Lycksele"], "values": [-1.5e3]}],
+        "total": 1.5e3,
+        "metadata": [{"updated": "2018-01-01"}]}""".encode("utf-8")
+
+    def _chunks(self, data, size):
+        return [data[i:i + size] for i in range(0, len(data), size)]
+
+    def test_chunked_response(self):
+        """Any chunk size gives the same result."""
+        expected = [
+            ("columns", [{"code": "Region", "type": "d"}]),
+            ("comments", []),
+            ("data", {"key": [u"Umeå"], "values": ["12345"]}),
+            ("data", {"key": ["Lycksele"], "values": [-1500.0]}),
+            ("total", 1500.0),
+            ("metadata", [{"updated": "2018-01-01"}]),
+        ]
+        for size in (1, 2, 3, 7, 1000):
+            stream = iter_json_stream(self._chunks(self.RESPONSE, size),
+                                      "data")
+            self.assertEqual(list(stream), expected)
+
+    def test_number_across_chunks(self):
+        stream = iter_json_stream([b'{"data": [12', b'34]}'], "data")
+        self.assertEqual(list(stream), [("data", 1234)])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_stream([b'{"data": [] }'], "data")),
+                         [])
+        self.assertEqual(list(iter_json_stream([b'{}'], "data")), [])
+
+    def test_invalid_response(self):
+        for data in (b"", b"Too many values selected", b'{"data": [1, 2'):
+            with self.assertRaises(JSONDecodeError):
+                list(iter_json_stream(self._chunks(data, 3), "data"))
+
+
+class TestJSONStat(TestCase):
+
+    def test_decode(self):
+        data = {
+            "id": ["Region", "ContentsCode", "Tid"],
+            "size": [2, 1, 3],
+            "role": {"metric": ["ContentsCode"], "time": ["Tid"]},
+            "dimension": {
+                "Region": {"category": {"index": {"01": 0, "03": 1}}},
+                "ContentsCode": {"category": {"label": {"BE0101": "Pop"}}},
+                "Tid": {"category": {"index": ["2015", "2016", "2017"]}},
+            },
+            "value": [1, 2, 3, 4, 5, None],
+        }
+        batch = decode_json_stat(data)
+        self.assertEqual(list(batch), ["value", "Region", "Tid"])
+        self.assertEqual(list(batch["Region"]),
+                         ["01", "01", "01", "03", "03", "03"])
+        self.assertEqual(list(batch["Tid"]),
+                         ["2015", "2016", "2017", "2015", "2016", "2017"])
+        self.assertEqual(batch["value"][5], None)
+
+        data["value"] = {"1": 2, "5": 6}
+        batch = decode_json_stat(data)
+        self.assertEqual(batch["value"], [2, 6])
+        self.assertEqual(list(batch["Region"]), ["01", "03"])
+        self.assertEqual(list(batch["Tid"]), ["2016", "2017"])
+
+
+class TestDecodeRows(TestCase):
+
+    def test_decode(self):
+        """Each value of a row gets the dimensions of the row."""
+        columns = [{"code": "Region", "type": "d"},
+                   {"code": "Tid", "type": "t"}]
+        rows = [{"key": ["01", "2016"], "values": ["1", "2"]},
+                {"key": ["03", "2016"], "values": ["3", "4"]},
+                {"key": ["01", "2017"], "values": ["5", "6"]}]
+        batch = decode_rows(columns, rows)
+        self.assertEqual(batch["value"], ["1", "2", "3", "4", "5", "6"])
+        self.assertEqual(list(batch["Region"]),
+                         ["01", "01", "03", "03", "01", "01"])
+        self.assertEqual(list(batch["Region"].categories), ["01", "03"])
+        self.assertEqual(list(batch["Tid"]),
+                         ["2016", "2016", "2016", "2016", "2017", "2017"])
+
+
+class Response(object):
+
+    def __init__(self, data):
+        self.content = dumps(data).encode("utf-8")
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def close(self):
+        pass
+
+
+class Session(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def post(self, url, json=None, stream=False):
+        return Response(self.data)
+
+
+class ResponsePXWeb(PXWeb):
+    """Answers queries with a fixed response."""
+
+    base_url = "http://api.example.com/v1/sv/db"
+
+    def _wait_for_rate_limit(self):
+        pass
+
+
+class TestBatches(TestCase):
+
+    def setUp(self):
+        self._batch_rows = PXWebScraper.BATCH_ROWS
+        PXWebScraper.BATCH_ROWS = 2
+
+    def tearDown(self):
+        PXWebScraper.BATCH_ROWS = self._batch_rows
+
+    def batches(self, data):
+        scraper = ResponsePXWeb()
+        scraper.session = Session(data)
+        dataset = Dataset("table", blob={"id": "table"})
+        dataset.scraper = scraper
+        return list(scraper._fetch_query(dataset, {}, "item"))
+
+    def test_contents_only(self):
+        """Rows without dimensions are decoded in batches too."""
+        batches = self.batches(OrderedDict([
+            ("columns", [{"code": "BE0101N1", "type": "c"}]),
+            ("data", [{"key": [], "values": [str(i)]} for i in range(5)]),
+        ]))
+        self.assertEqual([len(b["value"]) for b in batches], [2, 2, 1])
+
+    def test_columns_last(self):
+        """Rows before the columns are buffered, and then decoded."""
+        batches = self.batches(OrderedDict([
+            ("data", [{"key": [str(i)], "values": ["1"]} for i in range(5)]),
+            ("columns", [{"code": "Region", "type": "d"}]),
+        ]))
+        self.assertEqual(sum((list(b["Region"]) for b in batches), []),
+                         ["0", "1", "2", "3", "4"])
@@ -1,9 +1,63 @@
+# encoding: utf-8
 from unittest import TestCase
+from collections import OrderedDict
 
-from statscraper import Result, ResultSet
+from six.moves import cPickle as pickle
+from statscraper import (BaseScraper, Dataset, Dimension, DimensionValue,
+                         Result, ResultSet, ColumnarResultSet, DiskResultSet,
+                         NoSuchItem)
+import numpy as np
+import pandas as pd
 from pandas.api import types as ptypes
 
 
+class Scraper(BaseScraper):
+    """A scraper with hardcoded yields."""
+
+    def _fetch_itemslist(self, item):
+        yield Dataset("Dataset_1")
+
+    def _fetch_dimensions(self, dataset):
+        yield Dimension(u"municipality", datatype="region")
+        yield Dimension(u"year")
+
+    def _fetch_data(self, dataset, query=None):
+        yield Result(127, {
+            "municipality": "Robertsfors kommun",
+            "year": "2017",
+        })
+        yield Result(12, {
+            "municipality": u"Umeå kommun",
+            "year": "2017",
+        })
+
+
+class ColumnarScraper(BaseScraper):
+    """A scraper storing its data column by column."""
+
+    resultset_class = ColumnarResultSet
+
+    def _fetch_itemslist(self, item):
+        yield Dataset("Dataset_1")
+
+    def _fetch_dimensions(self, dataset):
+        yield Dimension(u"municipality", datatype="region")
+        yield Dimension(u"month", datatype="month", dialect="swedish")
+
+    def _fetch_data(self, dataset, query=None):
+        yield Result(127, {
+            "municipality": "Robertsfors kommun",
+            "month": "mars",
+        })
+        yield Result(12, {
+            "municipality": u"Umeå kommun",
+            "month": "april",
+        })
+        yield Result(14, {
+            "municipality": "Robertsfors kommun",
+        })
+
+
 class TestResultSet(TestCase):
 
     def test_pandas_export(self):
@@ -12,3 +66,231 @@ class TestResultSet(TestCase):
         result.append(Result(45483, {'city': "Voi"}))
         df = result.pandas
         self.assertTrue(ptypes.is_numeric_dtype(df.value))
+
+    def test_result_api(self):
+        """Results can be read as dicts, tuples and by dimension."""
+        result = Scraper().items[0].data[0]
+        self.assertEqual(result.value, 127)
+        self.assertEqual(result["municipality"], "Robertsfors kommun")
+        self.assertEqual(result["municipality"].dimension.datatype.id,
+                         "region")
+        self.assertEqual(dict(result), {"value": 127,
+                                        "municipality": "Robertsfors kommun",
+                                        "year": "2017"})
+        self.assertEqual(result.tuple, (127, {
+            "municipality": "Robertsfors kommun",
+            "year": "2017"}))
+        self.assertEqual(result.raw_dimensions["year"], "2017")
+        with self.assertRaises(NoSuchItem):
+            result["gender"]
+
+    def test_compact_results(self):
+        """Results have no __dict__, and share their dimensions."""
+        data = Scraper().items[0].data
+        self.assertFalse(hasattr(data[0], "__dict__"))
+        self.assertTrue(data[0]._dimensions is data[1]._dimensions)
+
+    def test_pickle_result(self):
+        """Results and dimension values can be pickled."""
+        result = Result(127, {"municipality": "Robertsfors kommun"})
+        value = DimensionValue(u"Umeå kommun", Dimension("municipality"),
+                               label=u"Umeå")
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(result, protocol))
+            self.assertEqual(copied.value, 127)
+            self.assertEqual(copied.raw_dimensions,
+                             {"municipality": "Robertsfors kommun"})
+            copied = pickle.loads(pickle.dumps(value, protocol))
+            self.assertEqual((copied.value, copied.id, copied.label),
+                             (u"Umeå kommun", "municipality", u"Umeå"))
+
+    def test_translate_copy(self):
+        """Translating does not change the original ResultSet."""
+        data = Scraper().items[0].data
+        translated = data.translate("scb")
+        self.assertEqual(str(translated[0]["municipality"]),
+                         "2409 Robertsfors kommun")
+        self.assertEqual(str(data[0]["municipality"]), "Robertsfors kommun")
+        self.assertTrue(data[0].resultset is data)
+
+    def test_extend(self):
+        """Extending a ResultSet normalizes the results."""
+        data = Scraper().items[0].data
+        data.extend([Result(1, {"municipality": u"Umeå kommun"})])
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[2]["municipality"].dimension.datatype.id,
+                         "region")
+
+
+class TestColumnarResultSet(TestCase):
+
+    def setUp(self):
+        self.data = ColumnarScraper().items[0].data
+
+    def test_results(self):
+        """Rows are available as Result objects."""
+        data = self.data
+        self.assertTrue(isinstance(data, ColumnarResultSet))
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0].value, 127)
+        self.assertEqual(data[0]["month"], "march")
+        self.assertEqual(data[-1].dict, {"value": 14,
+                                         "municipality": "Robertsfors kommun"})
+        self.assertEqual([r.value for r in data], [127, 12, 14])
+        self.assertEqual([r.value for r in data[1:]], [12, 14])
+
+    def test_pandas_export(self):
+        """Dimensions are exported as categoricals."""
+        df = self.data.pandas
+        self.assertTrue(ptypes.is_numeric_dtype(df.value))
+        self.assertTrue(ptypes.is_categorical_dtype(df.municipality))
+        self.assertEqual(list(df.municipality.cat.categories),
+                         ["Robertsfors kommun", u"Umeå kommun"])
+        self.assertEqual(list(df.month.astype(object).fillna("")),
+                         ["march", "april", ""])
+
+    def test_translate(self):
+        data = self.data.translate("scb")
+        self.assertEqual(str(data[2]["municipality"]),
+                         "2409 Robertsfors kommun")
+        self.assertEqual(len(data.pandas.municipality.cat.categories), 2)
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            data = pickle.loads(pickle.dumps(self.data, protocol))
+            self.assertEqual(len(data), 3)
+            self.assertEqual(data[0]["month"], "march")
+            self.assertEqual(data[2].dict, self.data[2].dict)
+
+    def test_fetch_next(self):
+        """Yielded rows are normalized, like stored ones."""
+        for cache in (True, False):
+            results = list(ColumnarScraper().items[0].fetch_next(cache=cache))
+            self.assertEqual(results[0]["month"], "march")
+            self.assertEqual(dict(results[1]), {"value": 12,
+                                                "municipality": u"Umeå kommun",
+                                                "month": "april"})
+
+
+class TestFetchNext(TestCase):
+
+    def test_no_cache(self):
+        """Streamed rows are normalized, but not kept."""
+        dataset = ColumnarScraper().items[0]
+        results = list(dataset.fetch_next(cache=False))
+        self.assertEqual([r.value for r in results], [127, 12, 14])
+        self.assertEqual(results[0]["month"], "march")
+        self.assertEqual(len(results[0].resultset), 0)
+        self.assertEqual(len(dataset.scraper.cache), 0)
+
+    def test_cache_hit(self):
+        """Cached rows are yielded once, without fetching again."""
+        dataset = Scraper().items[0]
+        first = list(dataset.fetch_next())
+        second = list(dataset.fetch_next())
+        self.assertEqual(len(second), 2)
+        self.assertTrue(first[0] is second[0])
+
+    def test_incomplete_fetch(self):
+        """A generator that is not exhausted does not fill the cache."""
+        dataset = Scraper().items[0]
+        next(dataset.fetch_next())
+        self.assertEqual(len(dataset.scraper.cache), 0)
+        self.assertEqual(len(dataset.data), 2)
+
+
+class TestDiskResultSet(TestCase):
+
+    def setUp(self):
+        dataset = ColumnarScraper().items[0]
+        list(dataset.fetch_next(cache="disk"))
+        self.data = dataset.data
+
+    def test_results(self):
+        data = self.data
+        self.assertTrue(isinstance(data, DiskResultSet))
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0]["month"], "march")
+        self.assertEqual(data[-1].dict, {"value": 14,
+                                         "municipality": "Robertsfors kommun"})
+        self.assertEqual([r.value for r in data[1:]], [12, 14])
+        self.assertEqual(list(self.data.pandas.value), [127, 12, 14])
+
+    def test_translate(self):
+        data = self.data.translate("scb")
+        self.assertTrue(isinstance(data, DiskResultSet))
+        self.assertEqual(str(data[0]["municipality"]),
+                         "2409 Robertsfors kommun")
+        self.assertEqual(str(self.data[0]["municipality"]),
+                         "Robertsfors kommun")
+
+
+class BatchScraper(BaseScraper):
+    """A scraper yielding batches of results."""
+
+    def _fetch_itemslist(self, item):
+        yield Dataset("Dataset_1")
+
+    def _fetch_dimensions(self, dataset):
+        yield Dimension(u"municipality", datatype="region")
+        yield Dimension(u"month", datatype="month", dialect="swedish")
+
+    def _fetch_data(self, dataset, query=None):
+        yield OrderedDict([
+            ("value", [127, 12, 14]),
+            ("municipality", pd.Categorical.from_codes(
+                [0, 1, 0], ["Robertsfors kommun", u"Umeå kommun"])),
+            ("month", ["mars", "april", None]),
+        ])
+        yield Result(3, {"month": "maj"})
+
+
+class TestBatches(TestCase):
+
+    def _check(self, data):
+        self.assertEqual(len(data), 4)
+        self.assertEqual(data[0]["month"], "march")
+        self.assertEqual(data[2].dict, {"value": 14,
+                                        "municipality": "Robertsfors kommun"})
+        self.assertEqual(data[3].dict, {"value": 3, "month": "may"})
+        self.assertEqual(data[1]["municipality"].dimension.datatype.id,
+                         "region")
+
+    def test_batches(self):
+        """Batches are normalized like results."""
+        self._check(BatchScraper().items[0].data)
+
+    def test_columnar_batches(self):
+        scraper = BatchScraper()
+        scraper.resultset_class = ColumnarResultSet
+        data = scraper.items[0].data
+        self._check(data)
+        self.assertEqual(list(data.pandas.month.cat.categories),
+                         ["march", "april", "may"])
+
+    def test_fetch_next(self):
+        for cache in (True, False, "disk"):
+            dataset = BatchScraper().items[0]
+            self._check(list(dataset.fetch_next(cache=cache)))
+
+    def test_dataframe_batch(self):
+        """Data frames can be added with extend()."""
+        data = ResultSet()
+        data.dataset = BatchScraper().items[0]
+        data.extend(pd.DataFrame({
+            "value": [1.5, 2.5],
+            "month": pd.Series(["mars", "april"], dtype="category"),
+            "municipality": [u"Umeå kommun", None],
+        }))
+        self.assertEqual(data[0].dict, {"value": 1.5, "month": "march",
+                                        "municipality": u"Umeå kommun"})
+        self.assertEqual(data[1].dict, {"value": 2.5, "month": "april"})
+
+    def test_record_array_batch(self):
+        """Structured numpy arrays are batches, with a column per field."""
+        data = ResultSet()
+        data.dataset = BatchScraper().items[0]
+        data.extend(np.array([(1.5, u"mars"), (2.5, u"april")],
+                             dtype=[("value", "f8"), ("month", "U10")]))
+        self.assertEqual(data[0].dict, {"value": 1.5, "month": "march"})
+        self.assertEqual(data[1].dict, {"value": 2.5, "month": "april"})
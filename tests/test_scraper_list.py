@@ -0,0 +1,103 @@
+# encoding: utf-8
+
+from copy import copy
+from unittest import TestCase
+from six.moves import cPickle as pickle
+from statscraper import (Dimension, DimensionList, DimensionValue, ValueList,
+                         NoSuchItem)
+
+
+class TestBaseScraperList(TestCase):
+
+    def test_lookup_after_modifications(self):
+        """Lookups stay correct as the list changes."""
+        dimensions = DimensionList()
+        dimensions.append(Dimension("year"))
+        self.assertTrue("year" in dimensions)
+        self.assertEqual(dimensions["year"].id, "year")
+
+        dimensions.append(Dimension("region"))
+        dimensions.insert(0, Dimension("gender"))
+        self.assertEqual(dimensions["region"].id, "region")
+        self.assertEqual(dimensions["gender"], dimensions[0])
+
+        del dimensions[1]
+        self.assertFalse("year" in dimensions)
+        with self.assertRaises(NoSuchItem):
+            dimensions["year"]
+
+        dimensions[:] = [Dimension("age")]
+        self.assertFalse("region" in dimensions)
+        self.assertTrue("age" in dimensions)
+
+    def test_first_match_wins(self):
+        """Duplicated ids return the first item, like a scan would."""
+        first = Dimension("year", label="First")
+        dimensions = DimensionList([first, Dimension("year", label="Second")])
+        self.assertTrue(dimensions["year"] is first)
+        self.assertTrue(dimensions.get_by_label("Second") is dimensions[1])
+
+    def test_lookup_by_identity(self):
+        dimension = Dimension("year")
+        dimensions = DimensionList([dimension])
+        self.assertTrue(dimension in dimensions)
+        self.assertTrue(dimensions[dimension] is dimension)
+        self.assertFalse(Dimension("year") in dimensions)
+
+    def test_label_modified_in_place(self):
+        """Items relabeled after indexing are still found."""
+        values = ValueList([DimensionValue("male", Dimension("gender")),
+                            DimensionValue("female", Dimension("gender"))])
+        self.assertTrue(values.get_by_label("Women") is None)
+        values["female"].label = "Women"
+        self.assertTrue(values.get_by_label("Women") is values[1])
+
+    def test_renamed_in_place(self):
+        dimension = Dimension("year")
+        dimensions = DimensionList([dimension, Dimension("region")])
+        self.assertTrue("year" in dimensions)
+        dimension.id = "age"
+        self.assertFalse("year" in dimensions)
+        self.assertTrue(dimensions["age"] is dimension)
+
+    def test_miss_without_scan(self):
+        """A lookup miss does not scan the list."""
+        dimensions = ScanCountingList([Dimension("year"), Dimension("region")])
+        self.assertTrue("year" in dimensions)
+        self.assertEqual(dimensions["year"].id, "year")
+        scans = dimensions.scans
+        self.assertFalse("age" in dimensions)
+        self.assertTrue(dimensions.get_by_label("Age") is None)
+        self.assertEqual(dimensions.scans, scans + 1)  # The label index
+        with self.assertRaises(NoSuchItem):
+            dimensions["age"]
+        self.assertEqual(dimensions.scans, scans + 1)
+
+    def test_copy(self):
+        """Copies have indexes of their own."""
+        dimensions = DimensionList([Dimension("year")])
+        self.assertTrue("year" in dimensions)
+        copied = copy(dimensions)
+        copied.append(Dimension("region"))
+        self.assertTrue("region" in copied)
+        self.assertFalse("region" in dimensions)
+
+    def test_pickle(self):
+        """Lists and their items are pickled without their indexes."""
+        values = ValueList([DimensionValue("male", Dimension("gender"))])
+        self.assertTrue("male" in values)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(values, protocol))
+            self.assertTrue(copied["male"] is copied[0])
+            copied[0].value = "female"
+            self.assertTrue("female" in copied)
+            self.assertTrue("male" in values)
+
+
+class ScanCountingList(DimensionList):
+
+    scans = 0
+
+    def __iter__(self):
+        self.scans += 1
+        return super(ScanCountingList, self).__iter__()
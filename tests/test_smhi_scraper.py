@@ -1,7 +1,16 @@
 # encoding: utf-8
+from datetime import datetime, timedelta
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Thread
 from unittest import TestCase
+from six.moves.queue import Queue
 import pandas as pd
-from statscraper.scrapers.SMHIScraper import SMHI, Collection, API, SMHIDataset, Station
+from statscraper import NoSuchItem
+from statscraper.cache import DocumentCache
+from statscraper.scrapers.SMHIScraper import (SMHI, Collection, API, SMHIDataset, Station, DataCsv,
+                                              ObservationStore, StationDimension, covering_periods,
+                                              read_columns, _columns)
 
 
 class TestSMHI(TestCase):
@@ -101,3 +110,382 @@ class TestSMHI(TestCase):
         self.assertTrue(len(parameters) == 2)
         for parameter in parameters:
             self.assertTrue(parameter in datasets)
+
+
+class DownloadingSMHI(SMHI):
+    """Answers csv downloads without asking the API."""
+
+    def __init__(self, *args, **kwargs):
+        super(DownloadingSMHI, self).__init__(*args, **kwargs)
+        self.release = Event()  # Holds the downloads of A back until set
+        self.finished = Queue()  # Gets the other downloads, as they finish
+
+    def _fetch_csv(self, dataset, station, period):
+        if station == "A":
+            self.release.wait(5)
+        url = "{}/{}".format(station, period)
+        if station != "A":
+            self.finished.put(url)
+        if period == "latest-hour":
+            return (url, 404, None)
+        return (url, 200, pd.DataFrame({"value": [1.0], "station": [station]}))
+
+
+class TestConcurrentDownloads(TestCase):
+
+    jobs = [(s, p) for s in ["A", "B", "C"]
+            for p in ["latest-day", "latest-hour"]]
+
+    def test_ordered(self):
+        calls = []
+        scraper = DownloadingSMHI()
+
+        def release():
+            # Let the downloads of A finish last
+            for _ in range(4):
+                scraper.finished.get(timeout=5)
+            scraper.release.set()
+        Thread(target=release).start()
+
+        frames = scraper._fetch_frames(
+            None, self.jobs, True, lambda *args: calls.append(args))
+        self.assertEqual([f["station"][0] for f in frames], ["A", "B", "C"])
+        self.assertEqual([c[:2] for c in calls], [(i, 6) for i in range(1, 7)])
+        self.assertEqual(calls[1][2:], ("A/latest-hour", 404))
+
+    def test_unordered(self):
+        scraper = DownloadingSMHI()
+        frames = scraper._fetch_frames(None, self.jobs, False, None)
+        stations = [next(frames)["station"][0], next(frames)["station"][0]]
+        scraper.release.set()
+        stations += [f["station"][0] for f in frames]
+        self.assertEqual(sorted(stations), ["A", "B", "C"])
+        self.assertEqual(stations[-1], "A")
+
+
+DATA_CSV = u"""Stationsnamn;Stationsnummer;Stationsnät;Mäthöjd (meter över marken)
+Abisko;188790;SMHIs stationsnät;2.0
+
+Parameternamn;Beskrivning;Enhet
+Lufttemperatur;momentanvärde, 1 gång/tim;degree celsius
+
+Datum;Tid (UTC);Lufttemperatur;Kvalitet;;Tidsutsnitt:
+1913-01-01;06:00:00;-10.0;Y;;Kvalitetskontrollerade historiska data
+1913-01-01;12:00:00;-8.5;Y;;Tidsperiod (fr.o.m.) = 1913-01-01
+1913-01-01;18:00:00;-7.0;G
+""".encode("utf-8")
+
+
+LATEST_DAY_CSV = u"""Stationsnamn;Stationsnummer;Stationsnät;Mäthöjd (meter över marken)
+Abisko;188790;SMHIs stationsnät;2.0
+
+Parameternamn;Beskrivning;Enhet
+Lufttemperatur;momentanvärde, 1 gång/tim;degree celsius
+
+Datum;Tid (UTC);Lufttemperatur;Kvalitet;;Tidsutsnitt:
+2018-01-10;11:00:00;-3.5;Y;;Data från senaste dygnet
+;;;;;Tidsperiod (fr.o.m.) = 2018-01-09 12:00:00 (UTC)
+;;;;;Tidsperiod (t.o.m.) = 2018-01-10 11:00:00 (UTC)
+;;;;;Samplingstid = Ca 10 min
+""".encode("utf-8")
+
+
+class TestDataCsv(TestCase):
+
+    def test_parse(self):
+        csv = DataCsv().from_string(DATA_CSV)
+        self.assertEqual(csv.columns,
+                         [u"Datum", u"Tid (UTC)", u"Lufttemperatur", u"Kvalitet"])
+        self.assertEqual(list(csv.frame[u"Lufttemperatur"]), [-10.0, -8.5, -7.0])
+        self.assertEqual(csv.to_dictlist()[2],
+                         {u"Datum": u"1913-01-01", u"Tid (UTC)": u"18:00:00",
+                          u"Lufttemperatur": -7.0, u"Kvalitet": u"G"})
+        self.assertEqual(len(csv.tables), 2)
+        self.assertEqual(csv.tables[0][1],
+                         [u"Abisko", u"188790", u"SMHIs stationsnät", u"2.0"])
+
+    def test_trailing_notes(self):
+        """More notes than data rows, in the extra columns."""
+        columns = [u"Datum", u"Tid (UTC)", u"Lufttemperatur", u"Kvalitet"]
+        csv = DataCsv().from_string(LATEST_DAY_CSV)
+        self.assertEqual(csv.columns, columns)
+        self.assertEqual(csv.data, [[u"2018-01-10", u"11:00:00", -3.5, u"Y"]])
+        self.assertEqual(len(csv.tables), 2)
+
+        # Without a quality column, the last table is the data
+        csv = DataCsv().from_string(LATEST_DAY_CSV.replace(b"Kvalitet", b"Q"))
+        self.assertEqual(csv.columns, columns[:3] + [u"Q"])
+        self.assertEqual(len(csv.data), 1)
+        self.assertEqual(read_columns([LATEST_DAY_CSV.replace(b"Kvalitet", b"Q")]),
+                         columns[:3] + [u"Q"])
+
+    def test_no_data(self):
+        csv = DataCsv().from_string(DATA_CSV.split(b"\n1913")[0])
+        self.assertEqual(len(csv.columns), 4)
+        self.assertEqual(len(csv.frame), 0)
+        self.assertEqual(csv.data, [])
+
+
+def observations(hours_ago, value, period):
+    """A frame of hourly observations, like _fetch_csv returns."""
+    times = [datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+             - timedelta(hours=h) for h in hours_ago]
+    return pd.DataFrame({
+        u"Datum": [t.strftime("%Y-%m-%d") for t in times],
+        u"Tid (UTC)": [t.strftime("%H:%M:%S") for t in times],
+        u"Kvalitet": u"G",
+        u"value": float(value),
+        u"station_key": u"1",
+        u"period": period,
+    }, columns=[u"Datum", u"Tid (UTC)", u"Kvalitet", u"value",
+                u"station_key", u"period"])
+
+
+class Item(object):
+
+    def __init__(self, key, **kwargs):
+        self.key = key
+        self.__dict__.update(kwargs)
+
+
+class IncrementalSMHI(SMHI):
+    """Answers csv downloads from `self.files` ({period: frame or None})."""
+
+    def _fetch_csv(self, dataset, station, period):
+        self.downloads.append(period)
+        frame = self.files.get(period)
+        return (period, 200 if frame is not None else 404, frame)
+
+
+class TestIncrementalFetch(TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.scraper = IncrementalSMHI()
+        self.scraper.store = ObservationStore(self.dir)
+        self.dataset = Item("1", parent=Item("metobs"))
+        self.station = Item("1", label=u"Abisko", blob={"updated": 1})
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def update(self, files):
+        self.scraper.files = files
+        self.scraper.downloads = []
+        return self.scraper._update_station(self.dataset, self.station)[2]
+
+    def test_update(self):
+        # Nothing stored: Get everything. The archive wins on overlaps.
+        frame = self.update({
+            "corrected-archive": observations([5000, 4999, 3], 1, "corrected-archive"),
+            "latest-months": observations([3, 2], 2, "latest-months"),
+        })
+        self.assertEqual(self.scraper.downloads, ["latest-months", "corrected-archive"])
+        self.assertEqual(list(frame["value"]), [1.0, 1.0, 1.0, 2.0])
+
+        # The station is not updated: Nothing to download
+        frame = self.update({})
+        self.assertEqual(self.scraper.downloads, [])
+        self.assertEqual(len(frame), 4)
+
+        # Two hours since the last observation. Latest day covers that.
+        self.station.blob["updated"] = 2
+        frame = self.update({
+            "latest-day": observations([2, 1, 0], 3, "latest-day"),
+        })
+        self.assertEqual(self.scraper.downloads, ["latest-day"])
+        self.assertEqual(list(frame["value"]), [1.0, 1.0, 1.0, 3.0, 3.0, 3.0])
+        self.assertEqual(list(frame["period"])[-1], "latest-day")
+
+        # The stored series is used by new scrapers too
+        scraper = IncrementalSMHI()
+        scraper.store = ObservationStore(self.dir)
+        self.scraper = scraper
+        self.station.blob["updated"] = 3
+        frame = self.update({
+            "latest-months": observations([1, 0], 4, "latest-months"),
+        })
+        # No hourly or daily data: Fall back to longer periods
+        self.assertEqual(self.scraper.downloads,
+                         ["latest-hour", "latest-day", "latest-months"])
+        self.assertEqual(list(frame["value"]), [1.0, 1.0, 1.0, 3.0, 4.0, 4.0])
+
+    def test_corrected_archive(self):
+        # Uncorrected observations older than the archive delay
+        self.update({
+            "corrected-archive": observations([3000], 1, "corrected-archive"),
+            "latest-months": observations([2200, 2], 2, "latest-months"),
+        })
+
+        # The archive was just checked
+        self.station.blob["updated"] = 2
+        self.update({"latest-day": observations([1], 3, "latest-day")})
+        self.assertEqual(self.scraper.downloads, ["latest-day"])
+
+        # A day later, it is checked again, and its values win
+        state, frame = self.scraper.store.get("metobs", "1", "1")
+        state["archive_checked"] -= timedelta(days=2)
+        self.scraper.store.set("metobs", "1", "1", state, frame)
+        self.station.blob["updated"] = 3
+        frame = self.update({
+            "latest-day": observations([0], 4, "latest-day"),
+            "corrected-archive": observations([3000, 2200], 5, "corrected-archive"),
+        })
+        self.assertEqual(self.scraper.downloads, ["latest-day", "corrected-archive"])
+        self.assertEqual(list(frame["value"]), [5.0, 5.0, 2.0, 3.0, 4.0])
+
+    def test_no_repeated_downloads(self):
+        self.update({
+            "corrected-archive": observations([24 * 30], 1, "corrected-archive"),
+        })
+        # Only latest-months covers a month, but it is not available
+        self.station.blob["updated"] = 2
+        self.update({})
+        self.assertEqual(self.scraper.downloads, ["latest-months", "corrected-archive"])
+
+    def test_covering_periods(self):
+        now = datetime(2018, 1, 10, 12)
+        self.assertEqual(covering_periods(None, now), [])
+        self.assertEqual(covering_periods(datetime(2018, 1, 10, 11, 30), now),
+                         ["latest-hour", "latest-day", "latest-months"])
+        self.assertEqual(covering_periods(datetime(2018, 1, 9), now),
+                         ["latest-months"])
+        self.assertEqual(covering_periods(datetime(2017, 1, 9), now), [])
+
+
+class Response(object):
+
+    status_code = 200
+    headers = {}
+
+    def json(self):
+        return {"station": [
+            {"key": "188790", "name": u"Abisko", "summary": "",
+             "updated": 1514764800000, "link": []},
+            {"key": "64510", "name": u"Växjö A", "summary": "",
+             "updated": 1514764800000, "link": []},
+        ]}
+
+
+class CsvResponse(object):
+
+    status_code = 200
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(DATA_CSV), chunk_size):
+            yield DATA_CSV[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class Session(object):
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, headers=None, stream=False):
+        self.urls.append(url)
+        if url.endswith(".csv"):
+            return CsvResponse()
+        return Response()
+
+
+class ParameterDataset(SMHIDataset):
+    url = "http://opendata-download-metobs.smhi.se/api/version/1.0/parameter/1.json"
+
+
+class OtherParameterDataset(SMHIDataset):
+    url = "http://opendata-download-metobs.smhi.se/api/version/1.0/parameter/5.json"
+
+
+class TestStations(TestCase):
+
+    def setUp(self):
+        self.scraper = SMHI()
+        self.scraper.session = Session()
+        self.scraper.documents = DocumentCache(persist=False)
+
+    def station_dimension(self):
+        dataset = ParameterDataset(u"Lufttemperatur", blob={"key": "1"})
+        dataset.scraper = self.scraper
+        dimension = StationDimension("station")
+        dimension.dataset = dataset
+        dimension.scraper = self.scraper
+        return dimension
+
+    def test_get_station(self):
+        dimension = self.station_dimension()
+        self.assertEqual(dimension.get_station("64510").label, u"Växjö A")
+        self.assertEqual(dimension.get_station(u"Abisko").key, "188790")
+        self.assertTrue(dimension.get_station(u"Abisko")
+                        is dimension.stations["188790"])
+        with self.assertRaises(NoSuchItem):
+            dimension.get_station(u"Atlantis")
+
+    def test_shared_document(self):
+        """The parameter document is fetched once, for all datasets."""
+        for i in range(3):
+            self.assertEqual(len(self.station_dimension().allowed_values), 2)
+        self.assertEqual(len(self.scraper.session.urls), 1)
+
+    def test_station_list(self):
+        dataset = self.station_dimension().dataset
+        stations = dataset._format_station_list(
+            self.station_dimension().allowed_values)
+        self.assertFalse("link" in stations[0])
+        self.assertTrue("link" in dataset.json["station"][0])
+
+    def test_columns(self):
+        """Columns are read once per parameter."""
+        _columns.pop(ParameterDataset.url, None)
+        for i in range(2):
+            dataset = self.station_dimension().dataset
+            self.assertEqual(dataset._get_columns()[2], u"Lufttemperatur")
+        self.assertEqual(len([u for u in self.scraper.session.urls
+                              if u.endswith(".csv")]), 1)
+
+    def test_columns_in_parallel(self):
+        """A slow parameter does not hold up the columns of others."""
+        started, released = Event(), Event()
+        get = self.scraper.session.get
+
+        def slow_get(url, **kwargs):
+            if "/parameter/1/" in url:
+                started.set()
+                released.wait(5)
+            return get(url, **kwargs)
+
+        self.scraper.session.get = slow_get
+        _columns.clear()
+        slow = self.station_dimension().dataset
+        thread = Thread(target=slow._get_columns)
+        thread.start()
+        self.assertTrue(started.wait(5))
+
+        dataset = OtherParameterDataset(u"Nederbörd", blob={"key": "5"})
+        dataset.scraper = self.scraper
+        self.assertEqual(len(dataset._get_columns()), 4)
+        self.assertTrue(thread.is_alive())
+        released.set()
+        thread.join()
+
+
+class TestReadColumns(TestCase):
+
+    def test_stop_at_data(self):
+        read = []
+
+        def chunks():
+            for i in range(0, len(DATA_CSV), 7):
+                read.append(i)
+                yield DATA_CSV[i:i + 7]
+
+        self.assertEqual(read_columns(chunks()),
+                         [u"Datum", u"Tid (UTC)", u"Lufttemperatur", u"Kvalitet"])
+        self.assertTrue(read[-1] < DATA_CSV.index(b"1913"))
+
+    def test_no_quality_column(self):
+        content = DATA_CSV.replace(u"Kvalitet".encode("utf-8"), b"Q")
+        self.assertEqual(read_columns([content]),
+                         [u"Datum", u"Tid (UTC)", u"Lufttemperatur", u"Q"])